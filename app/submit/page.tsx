@@ -14,6 +14,7 @@ export default function SubmitPage() {
   const [receiptNumber, setReceiptNumber] = useState("");
   const [amount, setAmount] = useState("");
   const [receiptImage, setReceiptImage] = useState<File | null>(null);
+  const [analysisId, setAnalysisId] = useState<number | null>(null);
 
   // Analysis State
   const [analysis, setAnalysis] = useState<{
@@ -71,6 +72,7 @@ export default function SubmitPage() {
     setMessage("");
     setMessageTone("info");
     setAnalysis(null);
+    setAnalysisId(null);
     try {
       const token = localStorage.getItem("gecb_token");
       const form = new FormData();
@@ -90,6 +92,7 @@ export default function SubmitPage() {
       if (data.receiptNumber) setReceiptNumber(String(data.receiptNumber));
       if (typeof data.amount === "number") setAmount(String(data.amount));
       if (!description && data.description) setDescription(String(data.description));
+      setAnalysisId(typeof data.analysisId === "number" ? data.analysisId : null);
 
       setAnalysis({
         estimatedPoints: data.estimatedPoints,
@@ -114,6 +117,11 @@ export default function SubmitPage() {
       setMessage("Please upload an invoice image first.");
       return;
     }
+    if (analysisId === null) {
+      setMessageTone("error");
+      setMessage("The invoice image has not been analyzed yet. Please upload it again.");
+      return;
+    }
     setLoading(true);
     setMessage("");
 
@@ -131,10 +139,17 @@ export default function SubmitPage() {
           description,
           receiptNumber,
           amount: parseFloat(amount),
+          analysisId,
         }),
       });
 
       if (res.ok) {
+        const data = await res.json();
+        if (data.status === "flagged") {
+          setMessageTone("info");
+          setMessage("⚠️ This receipt matches an earlier claim. It has been held for review and no points were credited yet.");
+          return;
+        }
         // Calculate estimated points (approx based on $1 = 3pts logic)
         const pts = Math.round(parseFloat(amount) * 3);
         setSubmittedData({
@@ -0,0 +1,130 @@
+"""
+Gemini client
+=============
+One process-wide google-genai client, used through its async surface
+(`client.aio`) so model calls never block the event loop. Its HTTP
+connection pool is reused across requests. GEMINI_MAX_CONCURRENCY caps
+how many calls are in flight at once; extra callers queue on a semaphore
+instead of piling onto the API.
+
+Plain REST calls (/api/ai/chat, ElevenLabs speech-to-text) share one
+app-lifetime `httpx.AsyncClient` with keep-alive, and HTTP/2 when `h2` is
+installed, so a chat message doesn't pay TCP+TLS setup. Which chat models
+exist is remembered for GEMINI_MODEL_CACHE_TTL: after the first discovery
+a chat goes straight to a known-good model instead of re-walking 404s.
+"""
+
+import os, asyncio, threading, time, importlib.util
+from typing import List
+
+import httpx
+
+from dotenv import load_dotenv
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+load_dotenv(os.path.join(PROJECT_ROOT, ".env"))
+load_dotenv(os.path.join(PROJECT_ROOT, ".env.example"))
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+MAX_CONCURRENCY = max(1, int(os.getenv("GEMINI_MAX_CONCURRENCY", "4")))
+TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "60"))
+CHAT_MODELS = list(dict.fromkeys([GEMINI_MODEL, "gemini-2.0-flash", "gemini-1.5-flash", "gemini-1.5-flash-latest"]))
+MODEL_CACHE_TTL = float(os.getenv("GEMINI_MODEL_CACHE_TTL", "3600"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP2 = importlib.util.find_spec("h2") is not None
+
+_client = None
+_client_lock = threading.Lock()
+_semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+_stats = {"calls": 0, "errors": 0, "inflight": 0, "waiting": 0, "totalMs": 0.0}
+
+class GeminiUnavailable(Exception):
+    pass
+
+def client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if not GEMINI_API_KEY:
+                    raise GeminiUnavailable("GEMINI_API_KEY is not configured")
+                from google import genai
+                _client = genai.Client(api_key=GEMINI_API_KEY)
+    return _client
+
+def image_part(data: bytes, mime_type: str = "image/jpeg"):
+    from google.genai import types
+    return types.Part.from_bytes(data=data, mime_type=mime_type)
+
+async def generate(contents, model: str = None):
+    """Non-blocking generate_content, bounded by GEMINI_MAX_CONCURRENCY."""
+    aio = client().aio
+    _stats["waiting"] += 1
+    async with _semaphore:
+        _stats["waiting"] -= 1
+        _stats["inflight"] += 1
+        t0 = time.perf_counter()
+        try:
+            return await asyncio.wait_for(
+                aio.models.generate_content(model=model or GEMINI_MODEL, contents=contents),
+                timeout=TIMEOUT,
+            )
+        except Exception:
+            _stats["errors"] += 1
+            raise
+        finally:
+            _stats["inflight"] -= 1
+            _stats["calls"] += 1
+            _stats["totalMs"] += (time.perf_counter() - t0) * 1000
+
+# ── Shared REST client ─────────────────────────────────────
+
+_http = None
+_models: dict[str, tuple[bool, float]] = {}  # model -> (available, checked at)
+
+def http() -> httpx.AsyncClient:
+    """App-lifetime pooled client; pass a per-call `timeout=`."""
+    global _http
+    if _http is None or _http.is_closed:
+        _http = httpx.AsyncClient(
+            http2=HTTP2,
+            timeout=httpx.Timeout(TIMEOUT, connect=10),
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                                max_keepalive_connections=HTTP_MAX_CONNECTIONS, keepalive_expiry=60),
+        )
+    return _http
+
+def chat_models() -> List[str]:
+    """CHAT_MODELS to try, known-good first; models recently seen missing are skipped."""
+    now = time.time()
+    known = {m: ok for m, (ok, at) in _models.items() if now - at < MODEL_CACHE_TTL}
+    return ([m for m in CHAT_MODELS if known.get(m) is True]
+            + [m for m in CHAT_MODELS if m not in known])
+
+def remember_model(model: str, available: bool):
+    _models[model] = (available, time.time())
+
+async def close():
+    global _client, _http
+    if _client is not None:
+        aclose = getattr(_client.aio, "aclose", None)
+        if aclose:
+            await aclose()
+        _client = None
+    if _http is not None:
+        await _http.aclose()
+        _http = None
+
+def stats() -> dict:
+    calls = _stats["calls"]
+    return {
+        "maxConcurrency": MAX_CONCURRENCY,
+        "inflight": _stats["inflight"],
+        "waiting": _stats["waiting"],
+        "calls": calls,
+        "errors": _stats["errors"],
+        "avgMs": round(_stats["totalMs"] / calls, 1) if calls else None,
+        "http2": HTTP2,
+        "chatModels": {m: ok for m, (ok, _) in _models.items()},
+    }
@@ -0,0 +1,134 @@
+"""
+Receipt analysis cache
+======================
+Content-addressed: entries are keyed by a hash of the image bytes, the
+model name and the prompt text, so a new model or prompt version misses
+naturally instead of serving stale extractions.
+
+  memory tier – LRU of ANALYSIS_CACHE_SIZE entries
+  disk tier   – one JSON file per key under ANALYSIS_CACHE_DIR, evicted by
+                least-recent use once it exceeds ANALYSIS_CACHE_DISK_MB
+
+Each result is stored under two keys: the raw upload hash, so an identical
+re-upload skips preprocessing too, and the normalised image hash, so the
+same photo re-encoded by the client still hits.
+
+get/put do blocking file I/O: async callers run them via asyncio.to_thread.
+The disk tier has its own lock, so memory hits never wait on the disk.
+"""
+
+import os, json, hashlib, threading
+from collections import OrderedDict
+from typing import Optional
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MEMORY_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "2000"))
+DISK_DIR = os.getenv("ANALYSIS_CACHE_DIR", os.path.join(PROJECT_ROOT, "backend", ".analysis_cache"))
+DISK_LIMIT = int(float(os.getenv("ANALYSIS_CACHE_DISK_MB", "50")) * 1024 * 1024)
+
+_memory: "OrderedDict[str, dict]" = OrderedDict()
+_lock = threading.Lock()       # memory tier and stats
+_disk_lock = threading.Lock()  # disk tier and _disk_bytes
+_disk_bytes: Optional[int] = None
+_stats = {"memoryHits": 0, "diskHits": 0, "misses": 0}
+
+def key(image_bytes: bytes, model: str, prompt: str) -> str:
+    h = hashlib.sha256()
+    for part in (model.encode("utf-8"), prompt.encode("utf-8"), image_bytes):
+        h.update(hashlib.sha256(part).digest())
+    return h.hexdigest()
+
+def _path(k: str) -> str:
+    return os.path.join(DISK_DIR, f"{k}.json")
+
+def _remember(k: str, result: dict):
+    _memory[k] = result
+    _memory.move_to_end(k)
+    while len(_memory) > MEMORY_SIZE:
+        _memory.popitem(last=False)
+
+# ── Disk tier ──────────────────────────────────────────────
+
+def _disk_usage() -> int:
+    global _disk_bytes
+    if _disk_bytes is None:
+        os.makedirs(DISK_DIR, exist_ok=True)
+        _disk_bytes = sum(e.stat().st_size for e in os.scandir(DISK_DIR) if e.name.endswith(".json"))
+    return _disk_bytes
+
+def _evict_disk():
+    global _disk_bytes
+    entries = sorted((e for e in os.scandir(DISK_DIR) if e.name.endswith(".json")),
+                     key=lambda e: e.stat().st_mtime)
+    target = DISK_LIMIT * 0.9  # free some headroom so we don't evict on every write
+    for e in entries:
+        if _disk_bytes <= target:
+            break
+        try:
+            size = e.stat().st_size
+            os.remove(e.path)
+            _disk_bytes -= size
+        except OSError:
+            pass
+
+def _read_disk(k: str) -> Optional[dict]:
+    try:
+        with open(_path(k), "r", encoding="utf-8") as f:
+            result = json.load(f)
+        os.utime(_path(k))  # recency for eviction
+        return result
+    except (OSError, ValueError):
+        return None
+
+def _write_disk(k: str, result: dict):
+    global _disk_bytes
+    data = json.dumps(result).encode("utf-8")
+    try:
+        _disk_usage()
+        if os.path.exists(_path(k)):
+            _disk_bytes -= os.path.getsize(_path(k))
+        tmp = _path(k) + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, _path(k))
+        _disk_bytes += len(data)
+        if _disk_bytes > DISK_LIMIT:
+            _evict_disk()
+    except OSError as e:
+        print(f"[analysis-cache] Disk write failed: {e}")
+
+# ── Public API ─────────────────────────────────────────────
+
+def get(*keys: str) -> Optional[dict]:
+    """First cached result among `keys` (memory, then disk)."""
+    with _lock:
+        for k in keys:
+            if k in _memory:
+                _memory.move_to_end(k)
+                _stats["memoryHits"] += 1
+                return dict(_memory[k])
+    for k in keys:
+        with _disk_lock:
+            result = _read_disk(k)
+        if result is not None:
+            with _lock:
+                _remember(k, result)
+                _stats["diskHits"] += 1
+            return dict(result)
+    with _lock:
+        _stats["misses"] += 1
+    return None
+
+def put(keys: list, result: dict):
+    with _lock:
+        for k in keys:
+            _remember(k, dict(result))
+    with _disk_lock:
+        for k in keys:
+            _write_disk(k, result)
+
+def stats() -> dict:
+    with _disk_lock:
+        disk_bytes = _disk_usage()
+    with _lock:
+        return {**_stats, "memoryEntries": len(_memory), "diskBytes": disk_bytes}
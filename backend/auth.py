@@ -0,0 +1,156 @@
+"""
+Stateless authentication
+========================
+Tokens carry the identity claims most endpoints need
+(uid, email, role, kyc/fraud flags) plus the user's `authVersion`.
+A verified-token cache keyed by token hash skips JWT decoding, and a
+compact uid -> version table decides whether the claims are current:
+  - same version       → identity straight from the token, no DB read
+  - older version      → flags changed since issue; identity rebuilt from the user record
+  - revoked (fraud)    → rejected
+The version table is filled lazily: the first request per user after a
+restart reads the user record once.
+"""
+
+import os, hashlib, threading, time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+import jwt
+from dotenv import load_dotenv
+
+from backend import db
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+load_dotenv(os.path.join(PROJECT_ROOT, ".env"))
+load_dotenv(os.path.join(PROJECT_ROOT, ".env.example"))
+
+JWT_SECRET = os.getenv("JWT_SECRET", "secret")
+ALGORITHM = "HS256"
+TOKEN_TTL = timedelta(days=7)
+TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+REVOKED = -1
+
+_tokens: "OrderedDict[str, tuple[dict, float]]" = OrderedDict()
+_tokens_lock = threading.Lock()
+_versions: dict[int, int] = {}
+
+# ── Tokens ─────────────────────────────────────────────────
+
+def issue_token(user: dict) -> str:
+    payload = {
+        "sub": user["email"],
+        "uid": user["_id"],
+        "role": user.get("role", "USER"),
+        "kyc": bool(user.get("kycComplete")),
+        "fraud": bool(user.get("fraudClear")),
+        "ver": int(user.get("authVersion", 0)),
+        "exp": datetime.utcnow() + TOKEN_TTL,
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm=ALGORITHM)
+
+def _decode(token: str) -> Optional[dict]:
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    now = time.time()
+    with _tokens_lock:
+        hit = _tokens.get(key)
+        if hit and hit[1] > now:
+            _tokens.move_to_end(key)
+            return hit[0]
+    try:
+        claims = jwt.decode(token, JWT_SECRET, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        return None
+    with _tokens_lock:
+        _tokens[key] = (claims, float(claims.get("exp", now)))
+        if len(_tokens) > TOKEN_CACHE_SIZE:
+            _tokens.popitem(last=False)
+    return claims
+
+def _bearer(authorization: Optional[str]) -> Optional[str]:
+    if not authorization:
+        return None
+    parts = authorization.split()
+    if len(parts) != 2 or parts[0].lower() != "bearer":
+        return None
+    return parts[1]
+
+# ── Version table ──────────────────────────────────────────
+
+def set_version(uid: int, version: int):
+    _versions[uid] = version
+
+def bump_version(user: dict) -> dict:
+    """Return `user` with a new authVersion; tokens issued before it fall back to a DB read."""
+    version = int(user.get("authVersion", 0)) + 1
+    _versions[user["_id"]] = version
+    return {**user, "authVersion": version}
+
+def revoke(uid: int):
+    _versions[uid] = REVOKED
+    with _tokens_lock:
+        for key in [k for k, (claims, _) in _tokens.items() if claims.get("uid") == uid]:
+            del _tokens[key]
+
+def _load_user(claims: dict) -> Optional[dict]:
+    user = None
+    if "uid" in claims:
+        user = db.get_by_id("verified_users", claims["uid"])
+    if not user and claims.get("sub"):
+        user = db.find_one("verified_users", "email", claims["sub"])
+    return user
+
+def identity_from_user(user: dict) -> dict:
+    return {
+        "_id": user["_id"],
+        "email": user["email"],
+        "role": user.get("role", "USER"),
+        "kycComplete": bool(user.get("kycComplete")),
+        "fraudClear": bool(user.get("fraudClear")),
+    }
+
+# ── Request helpers ────────────────────────────────────────
+
+def get_identity(authorization: Optional[str]) -> Optional[dict]:
+    """Identity claims for the bearer token; touches the DB only when claims are stale."""
+    token = _bearer(authorization)
+    if not token:
+        return None
+    claims = _decode(token)
+    if not claims or "uid" not in claims:
+        user = _load_user(claims) if claims else None
+        return identity_from_user(user) if user else None
+
+    uid = claims["uid"]
+    current = _versions.get(uid)
+    if current is None:
+        user = _load_user(claims)
+        if not user:
+            return None
+        current = int(user.get("authVersion", 0))
+        _versions[uid] = current
+        if claims.get("ver") != current:
+            return identity_from_user(user)
+    if current == REVOKED:
+        return None
+    if claims.get("ver") != current:
+        user = _load_user(claims)
+        return identity_from_user(user) if user else None
+    return {
+        "_id": uid,
+        "email": claims["sub"],
+        "role": claims.get("role", "USER"),
+        "kycComplete": bool(claims.get("kyc")),
+        "fraudClear": bool(claims.get("fraud")),
+    }
+
+def get_user(authorization: Optional[str]) -> Optional[dict]:
+    """Full user record, for handlers that need profile fields."""
+    token = _bearer(authorization)
+    if not token:
+        return None
+    claims = _decode(token)
+    if not claims or _versions.get(claims.get("uid")) == REVOKED:
+        return None
+    return _load_user(claims)
@@ -0,0 +1,76 @@
+"""
+Scalable Bloom filter
+=====================
+Answers "definitely not present" in microseconds. Used by the data layer
+to skip index/backend lookups for values that were never written
+(new signup emails, new receipt numbers).
+
+When a filter reaches capacity a new, larger and tighter one is stacked
+on top (Almeida et al., "Scalable Bloom Filters"), so the overall false
+positive rate stays under `error_rate` as the set grows.
+"""
+
+import hashlib, math, threading
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / self.capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        m = self.num_bits
+        return [(h1 + i * h2) % m for i in range(self.num_hashes)]
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+class ScalableBloomFilter:
+    def __init__(self, initial_capacity: int = 10_000, error_rate: float = 0.001,
+                 growth: int = 4, tightening: float = 0.5):
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            # Sum of a geometric series of per-filter error rates stays under error_rate
+            self.filters = [BloomFilter(self.initial_capacity, self.error_rate * (1 - self.tightening))]
+
+    def add(self, item: str):
+        with self._lock:
+            if any(item in f for f in self.filters):
+                return
+            current = self.filters[-1]
+            if current.count >= current.capacity:
+                current = BloomFilter(current.capacity * self.growth, current.error_rate * self.tightening)
+                self.filters.append(current)
+            current.add(item)
+
+    def __contains__(self, item: str) -> bool:
+        return any(item in f for f in reversed(self.filters))
+
+    def __len__(self) -> int:
+        return sum(f.count for f in self.filters)
+
+    def stats(self) -> dict:
+        return {
+            "items": len(self),
+            "filters": len(self.filters),
+            "bytes": sum(len(f.bits) for f in self.filters),
+        }
@@ -0,0 +1,78 @@
+"""
+Marketplace Catalog – in-process snapshot
+==========================================
+An immutable, versioned snapshot of the `marketplace` collection with
+precomputed per-type lists and cost-sorted orderings. Reads never touch
+the backend: the snapshot is built once, then patched from the db write
+listener whenever this process writes a marketplace record.
+"""
+
+import copy, hashlib, json, threading
+from typing import Optional, List
+
+from backend import db
+
+COLLECTION = "marketplace"
+SORTS = ("cost_asc", "cost_desc")
+
+class Snapshot:
+    def __init__(self, version: int, items: dict[int, dict]):
+        self.version = version
+        self.by_id = items
+        ordered = [items[k] for k in sorted(items)]
+        digest = hashlib.sha1(json.dumps(ordered, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        self.etag = f'"{version}-{digest[:16]}"'
+
+        self.views: dict[tuple[Optional[str], Optional[str]], List[dict]] = {}
+        types = {None} | {i.get("type") for i in ordered}
+        for t in types:
+            base = ordered if t is None else [i for i in ordered if i.get("type") == t]
+            by_cost = sorted(base, key=lambda i: (i.get("cost", 0), i["_id"]))
+            self.views[(t, None)] = base
+            self.views[(t, "cost_asc")] = by_cost
+            self.views[(t, "cost_desc")] = by_cost[::-1]
+
+    def view(self, type: Optional[str] = None, sort: Optional[str] = None) -> List[dict]:
+        return self.views.get((type, sort if sort in SORTS else None), [])
+
+_lock = threading.Lock()
+_items: dict[int, dict] = {}
+_snapshot: Optional[Snapshot] = None
+
+def _publish():
+    global _snapshot
+    version = (_snapshot.version + 1) if _snapshot else 1
+    _snapshot = Snapshot(version, dict(_items))
+
+def refresh() -> Snapshot:
+    """Reload the whole catalog from the backend."""
+    records = list(db.scan(COLLECTION))
+    with _lock:
+        _items.clear()
+        _items.update({r["_id"]: r for r in records})
+        _publish()
+        print(f"[catalog] Loaded {len(_items)} items (v{_snapshot.version})")
+        return _snapshot
+
+def snapshot() -> Snapshot:
+    return _snapshot or refresh()
+
+def get(item_id: int) -> Optional[dict]:
+    item = snapshot().by_id.get(item_id)
+    return copy.deepcopy(item) if item else None
+
+def _on_write(ids, payloads):
+    with _lock:
+        if _snapshot is None:
+            return  # nothing built yet; the first read loads everything
+        if ids is None:
+            _items.clear()
+        else:
+            for rid, payload in zip(ids, payloads):
+                if payload is None:
+                    _items.pop(rid, None)
+                else:
+                    _items[rid] = {**copy.deepcopy(payload), "_id": rid}
+        _publish()
+
+db.on_write(COLLECTION, _on_write)
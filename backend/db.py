@@ -5,11 +5,14 @@ Strict Actian VectorAI usage for real-time data.
 Collections: verified_users, fraud_users, transactions, claims, marketplace
 """
 
-import os, copy, uuid, time, json
-from typing import Optional, List
+import os, copy, uuid, time, json, hashlib, queue, threading, itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Iterator
 from datetime import datetime
 from dotenv import load_dotenv
 
+from backend.bloom import ScalableBloomFilter
+
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 
 ACTIAN_HOST = os.getenv("ACTIAN_HOST", "localhost:50051")
@@ -28,6 +31,10 @@ def next_id() -> int:
 def cuid() -> str:
     return uuid.uuid4().hex[:25]
 
+def stable_id(key: str) -> int:
+    """Deterministic 56-bit record id for per-key records (one row per user, etc.)."""
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=7).digest(), "big")
+
 def dummy_vec() -> list:
     return [0.0] * DIM
 
@@ -94,7 +101,72 @@ def _mem_ensure(col: str):
     if col not in _mem:
         _mem[col] = {}
 
-COLLECTIONS = ["verified_users", "fraud_users", "transactions", "claims", "marketplace", "green_scores", "user_wallets"]
+COLLECTIONS = ["verified_users", "fraud_users", "transactions", "claims", "marketplace", "green_scores", "user_wallets", "score_series", "wallet_snapshots", "item_neighbors", "category_examples", "receipt_analyses"]
+
+# ── Sharding ──────────────────────────────────────────────
+# High-volume collections can be split into DB_SHARDS physical collections
+# (transactions_s0 … transactions_sN), routed by a hash of the record's email.
+# DB_SHARDS=1 (default) keeps the single-collection layout.
+
+DB_SHARDS = max(1, int(os.getenv("DB_SHARDS", "1")))
+SHARDED_COLLECTIONS = [
+    c.strip() for c in os.getenv("DB_SHARDED_COLLECTIONS", "verified_users,user_wallets,transactions").split(",")
+    if c.strip()
+]
+
+_pool = ThreadPoolExecutor(max_workers=max(4, DB_SHARDS), thread_name_prefix="db")
+_id_shard: dict[tuple[str, int], int] = {}  # (collection, id) -> shard, learned on put / probe
+
+def is_sharded(collection: str) -> bool:
+    return DB_SHARDS > 1 and collection in SHARDED_COLLECTIONS
+
+def shard_for(key: str) -> int:
+    return stable_id(key) % DB_SHARDS
+
+def shard_name(collection: str, shard: int) -> str:
+    return f"{collection}_s{shard}" if is_sharded(collection) else collection
+
+def physical_collections(collection: Optional[str] = None) -> List[str]:
+    names = []
+    for name in ([collection] if collection else COLLECTIONS):
+        if is_sharded(name):
+            names.extend(shard_name(name, i) for i in range(DB_SHARDS))
+        else:
+            names.append(name)
+    return names
+
+def _route(collection: str, record_id: int, payload: dict) -> str:
+    if not is_sharded(collection):
+        return collection
+    shard = shard_for(payload.get("email") or str(record_id))
+    _id_shard[(collection, record_id)] = shard
+    return shard_name(collection, shard)
+
+def _candidates(collection: str, record_id: int) -> List[str]:
+    if not is_sharded(collection):
+        return [collection]
+    shard = _id_shard.get((collection, record_id))
+    return [shard_name(collection, shard)] if shard is not None else physical_collections(collection)
+
+def _gather(fn, names: List[str]) -> list:
+    """Run `fn` over each physical collection, in parallel when there is more than one."""
+    if len(names) == 1:
+        return [fn(names[0])]
+    return list(_pool.map(fn, names))
+
+def _warm_shard_directory():
+    if DB_SHARDS == 1:
+        return
+    for email, rid in _email_id_cache.items():
+        for col in ("verified_users", "fraud_users", "user_wallets"):
+            if is_sharded(col):
+                _id_shard[(col, rid)] = shard_for(email)
+    if is_sharded("transactions"):
+        for email, ids in _tx_email_cache.items():
+            for rid in ids:
+                _id_shard[("transactions", rid)] = shard_for(email)
+
+_warm_shard_directory()
 
 # ── Collection management ─────────────────────────────────
 
@@ -102,165 +174,574 @@ def setup_collections():
     if _USE_ACTIAN:
         from cortex import CortexClient, DistanceMetric
         with CortexClient(ACTIAN_HOST) as c:
-            for name in COLLECTIONS:
+            for name in physical_collections():
                 if not c.has_collection(name):
                     c.create_collection(name, DIM, distance_metric=DistanceMetric.EUCLIDEAN)
     else:
-        for name in COLLECTIONS:
+        for name in physical_collections():
             _mem_ensure(name)
-    return {"status": "ok", "collections": COLLECTIONS}
+    return {"status": "ok", "collections": COLLECTIONS, "shards": DB_SHARDS}
 
 def reset_collections():
     if _USE_ACTIAN:
         from cortex import CortexClient, DistanceMetric
         with CortexClient(ACTIAN_HOST) as c:
-            for name in COLLECTIONS:
+            for name in physical_collections():
                 if c.has_collection(name):
                     c.delete_collection(name)
                 c.create_collection(name, DIM, distance_metric=DistanceMetric.EUCLIDEAN)
+        _email_id_cache.clear()
+        _receipt_id_cache.clear()
+        _tx_email_cache.clear()
+        _save_cache()
     else:
-        for name in COLLECTIONS:
+        for name in physical_collections():
             _mem[name] = {}
-    return {"status": "reset", "collections": COLLECTIONS}
+    _id_shard.clear()
+    for bloom in _blooms.values():
+        bloom["filter"].clear()
+        bloom["ready"] = True
+    for name in COLLECTIONS:
+        _notify(name, None, None)
+    return {"status": "reset", "collections": COLLECTIONS, "shards": DB_SHARDS}
 
-# ── CRUD ──────────────────────────────────────────────────
+# ── Physical operations (one Cortex collection each) ──────
 
-def put(collection: str, record_id: int, payload: dict):
+def _put_physical(name: str, record_id: int, payload: dict):
     if _USE_ACTIAN:
         from cortex import CortexClient
         with CortexClient(ACTIAN_HOST) as c:
-            print(f"[db] Putting {record_id} into {collection}: {payload}")
+            print(f"[db] Putting {record_id} into {name}: {payload}")
             try:
-                c.upsert(collection, id=record_id, vector=dummy_vec(), payload=payload)
-                c.flush(collection)
+                c.upsert(name, id=record_id, vector=dummy_vec(), payload=payload)
+                c.flush(name)
                 print(f"[db] Success put {record_id}")
                 
                 # Verify immediately
-                check = c.get(collection, record_id)
+                check = c.get(name, record_id)
                 print(f"[db] Immediate check for {record_id}: {check}")
-
-                # Update cache if applicable
-                if collection in ["verified_users", "fraud_users", "user_wallets"] and payload.get("email"):
-                    _email_id_cache[payload["email"]] = record_id
-                
-                if collection == "claims" and payload.get("receiptNumber"):
-                    _receipt_id_cache[payload["receiptNumber"]] = record_id
-
-                # Cache transaction IDs per email
-                if collection == "transactions" and payload.get("email"):
-                    email = payload["email"]
-                    if email not in _tx_email_cache:
-                        _tx_email_cache[email] = []
-                    _tx_email_cache[email].append(record_id)
-                
-                _save_cache()
-
             except Exception as e:
                 print(f"[db] ERROR put: {e}")
                 raise e
     else:
-        _mem_ensure(collection)
-        _mem[collection][record_id] = copy.deepcopy(payload)
-        # Also cache for in-memory
-        if collection == "transactions" and payload.get("email"):
-            email = payload["email"]
-            if email not in _tx_email_cache:
-                _tx_email_cache[email] = []
-            if record_id not in _tx_email_cache[email]:
-                _tx_email_cache[email].append(record_id)
+        _mem_ensure(name)
+        _mem[name][record_id] = copy.deepcopy(payload)
 
-def get_by_id(collection: str, record_id: int) -> Optional[dict]:
+def _get_physical(name: str, record_id: int) -> Optional[dict]:
     if _USE_ACTIAN:
         from cortex import CortexClient
         with CortexClient(ACTIAN_HOST) as c:
             try:
-                result = c.get(collection, record_id)
-                if result and isinstance(result, tuple) and len(result) == 2:
+                result = c.get(name, record_id)
+                if result and isinstance(result, tuple) and len(result) == 2 and result[1] is not None:
                     return {**result[1], "_id": record_id}
             except Exception:
                 pass
         return None
     else:
-        _mem_ensure(collection)
-        data = _mem[collection].get(record_id)
+        _mem_ensure(name)
+        data = _mem[name].get(record_id)
         return {**copy.deepcopy(data), "_id": record_id} if data else None
 
-def get_all(collection: str, limit: int = 1000) -> List[dict]:
+def _get_many_physical(name: str, record_ids: List[int]) -> dict[int, dict]:
     if _USE_ACTIAN:
         from cortex import CortexClient
         with CortexClient(ACTIAN_HOST) as c:
             try:
-                result = c.scroll(collection, limit=limit)
+                results = c.get_many(name, ids=list(record_ids), with_vectors=False)
+            except Exception:
+                found = {rid: _get_physical(name, rid) for rid in record_ids}
+                return {rid: r for rid, r in found.items() if r}
+        return {rid: {**payload, "_id": rid} for rid, (_, payload) in zip(record_ids, results) if payload}
+    else:
+        _mem_ensure(name)
+        col = _mem[name]
+        return {rid: {**copy.deepcopy(col[rid]), "_id": rid} for rid in record_ids if rid in col}
+
+def _scroll_physical(name: str, limit: int) -> List[dict]:
+    if _USE_ACTIAN:
+        from cortex import CortexClient
+        with CortexClient(ACTIAN_HOST) as c:
+            try:
+                result = c.scroll(name, limit=limit)
                 records = result[0] if isinstance(result, tuple) else result
                 return [{"_id": r.id if hasattr(r,'id') else 0, **(r.payload if hasattr(r,'payload') else {})} for r in records]
             except Exception:
                 return []
     else:
-        _mem_ensure(collection)
-        return [{"_id": rid, **copy.deepcopy(data)} for rid, data in list(_mem[collection].items())[:limit]]
-
-def get_transactions_by_email(email: str) -> List[dict]:
-    """Retrieve transactions for a specific email using the write-through cache."""
-    tx_ids = _tx_email_cache.get(email, [])
-    results = []
-    for tid in tx_ids:
-        tx = get_by_id("transactions", tid)
-        if tx:
-            results.append(tx)
-    return results
+        _mem_ensure(name)
+        return [{"_id": rid, **copy.deepcopy(data)} for rid, data in list(_mem[name].items())[:limit]]
 
-def find_by(collection: str, field: str, value, limit: int = 100) -> List[dict]:
-    # In a real vector DB we'd filter, but Cortex might not support strict field filtering in scroll yet
-    # so we fetch and filter in app for this hackathon scale
-    all_items = get_all(collection, limit=10000)
-    return [r for r in all_items if r.get(field) == value][:limit]
-
-def find_one(collection: str, field: str, value) -> Optional[dict]:
-    # Check cache first for email lookup
-    if field == "email" and collection in ["verified_users", "fraud_users", "user_wallets"]:
-        cached_id = _email_id_cache.get(value)
-        if cached_id:
-            print(f"[db] Cache HIT for {value} -> {cached_id}")
-            # Verify it exists in DB (should be immediate via ID)
-            record = get_by_id(collection, cached_id)
-            if record: return record
-
-    # Check cache for receipt number
-    if field == "receiptNumber" and collection == "claims":
-        cached_id = _receipt_id_cache.get(value)
-        if cached_id:
-            print(f"[db] Cache HIT for receipt {value} -> {cached_id}")
-            record = get_by_id(collection, cached_id)
-            if record: return record
-
-    results = find_by(collection, field, value, limit=1)
-    return results[0] if results else None
-
-def delete_record(collection: str, record_id: int):
+def _delete_physical(name: str, record_id: int):
     if _USE_ACTIAN:
         from cortex import CortexClient
         with CortexClient(ACTIAN_HOST) as c:
             try:
-                c.delete(collection, record_id)
-                c.flush(collection)
+                c.delete(name, record_id)
+                c.flush(name)
             except: pass
     else:
-        _mem_ensure(collection)
-        if record_id in _mem[collection]:
-            del _mem[collection][record_id]
+        _mem_ensure(name)
+        if record_id in _mem[name]:
+            del _mem[name][record_id]
 
-def batch_put(collection: str, start_id: int, payloads: List[dict]):
+def _batch_put_physical(name: str, ids: List[int], payloads: List[dict]):
     if _USE_ACTIAN:
         from cortex import CortexClient
         with CortexClient(ACTIAN_HOST) as c:
-            ids = list(range(start_id, start_id + len(payloads)))
             vectors = [dummy_vec() for _ in payloads]
-            c.batch_upsert(collection, ids=ids, vectors=vectors, payloads=payloads)
-            c.flush(collection)
+            c.batch_upsert(name, ids=ids, vectors=vectors, payloads=payloads)
+            c.flush(name)
+    else:
+        _mem_ensure(name)
+        for rid, payload in zip(ids, payloads):
+            _mem[name][rid] = copy.deepcopy(payload)
+
+# ── Write listeners ───────────────────────────────────────
+# In-process caches built on top of a collection (catalog snapshot, search
+# indexes) subscribe here instead of polling. Listeners get (ids, payloads);
+# a payload of None means the record was deleted, and ids=None means the
+# whole collection was reset.
+
+_listeners: dict[str, list] = {}
+
+def on_write(collection: str, fn):
+    _listeners.setdefault(collection, []).append(fn)
+
+def _notify(collection: str, ids: Optional[List[int]], payloads: Optional[List[Optional[dict]]]):
+    for fn in _listeners.get(collection, []):
+        try:
+            fn(ids, payloads)
+        except Exception as e:
+            print(f"[db] Write listener failed for {collection}: {e}")
+
+# ── CRUD ──────────────────────────────────────────────────
+
+def _index_write(collection: str, record_id: int, payload: dict):
+    _bloom_add(collection, payload)
+    if _USE_ACTIAN:
+        # Update cache if applicable
+        if collection in ["verified_users", "fraud_users", "user_wallets"] and payload.get("email"):
+            _email_id_cache[payload["email"]] = record_id
+        
+        if collection == "claims" and payload.get("receiptNumber"):
+            _receipt_id_cache[payload["receiptNumber"]] = record_id
+
+    # Cache transaction IDs per email
+    if collection == "transactions" and payload.get("email"):
+        email = payload["email"]
+        if email not in _tx_email_cache:
+            _tx_email_cache[email] = []
+        if record_id not in _tx_email_cache[email]:
+            _tx_email_cache[email].append(record_id)
+
+def put(collection: str, record_id: int, payload: dict):
+    _put_physical(_route(collection, record_id, payload), record_id, payload)
+    _index_write(collection, record_id, payload)
+    if _USE_ACTIAN:
+        _save_cache()
+    _notify(collection, [record_id], [payload])
+
+def put_many(writes: List[tuple[str, int, dict]]):
+    """Write (collection, id, payload) records, possibly across collections,
+    with one batch upsert per physical collection, all issued concurrently."""
+    if not writes:
+        return
+    groups: dict[str, tuple[list, list]] = {}
+    for collection, rid, payload in writes:
+        name = _route(collection, rid, payload)
+        groups.setdefault(name, ([], []))
+        groups[name][0].append(rid)
+        groups[name][1].append(payload)
+    _gather(lambda n: _batch_put_physical(n, *groups[n]), list(groups))
+
+    by_collection: dict[str, tuple[list, list]] = {}
+    for collection, rid, payload in writes:
+        _index_write(collection, rid, payload)
+        by_collection.setdefault(collection, ([], []))
+        by_collection[collection][0].append(rid)
+        by_collection[collection][1].append(payload)
+    if _USE_ACTIAN:
+        _save_cache()
+    for collection, (ids, payloads) in by_collection.items():
+        _notify(collection, ids, payloads)
+
+def get_by_id(collection: str, record_id: int) -> Optional[dict]:
+    names = _candidates(collection, record_id)
+    if len(names) == 1:
+        return _get_physical(names[0], record_id)
+    # Unknown shard: probe every shard in parallel and remember where it lives
+    for shard, record in enumerate(_gather(lambda n: _get_physical(n, record_id), names)):
+        if record:
+            _id_shard[(collection, record_id)] = shard
+            return record
+    return None
+
+def get_many(collection: str, record_ids: List[int]) -> List[dict]:
+    """Fetch several records in one round trip per shard; missing ids are skipped."""
+    if not record_ids:
+        return []
+    if not is_sharded(collection):
+        found = _get_many_physical(collection, record_ids)
     else:
-        _mem_ensure(collection)
-        for i, payload in enumerate(payloads):
-            _mem[collection][start_id + i] = copy.deepcopy(payload)
+        groups: dict[str, List[int]] = {}
+        for rid in record_ids:
+            for name in _candidates(collection, rid):
+                groups.setdefault(name, []).append(rid)
+        names = list(groups)
+        found = {}
+        for part in _gather(lambda n: _get_many_physical(n, groups[n]), names):
+            found.update(part)
+    return [found[rid] for rid in record_ids if rid in found]
+
+def get_all(collection: str, limit: int = 1000) -> List[dict]:
+    if limit > SCAN_PAGE:
+        return list(itertools.islice(scan(collection), limit))
+    parts = _gather(lambda n: _scroll_physical(n, limit), physical_collections(collection))
+    return [r for part in parts for r in part][:limit]
+
+def tx_ids_for_email(email: str) -> List[int]:
+    """Transaction ids for `email` in append order (write-through cache)."""
+    return list(_tx_email_cache.get(email, []))
+
+def get_transactions_by_email(email: str) -> List[dict]:
+    """Retrieve transactions for a specific email using the write-through cache."""
+    return get_many("transactions", tx_ids_for_email(email))
+
+def delete_record(collection: str, record_id: int):
+    names = _candidates(collection, record_id)
+    _gather(lambda n: _delete_physical(n, record_id), names)
+    _id_shard.pop((collection, record_id), None)
+    _notify(collection, [record_id], [None])
+
+def batch_put(collection: str, start_id: int, payloads: List[dict]):
+    put_many([(collection, start_id + n, payload) for n, payload in enumerate(payloads)])
+
+# ── Parallel scans ────────────────────────────────────────
+# Full-collection scans split the id space into ranges and scroll them
+# concurrently over one shared, pooled client. Pages flow through a bounded
+# queue, so memory stays at ~SCAN_WORKERS * 2 pages whatever the collection size.
+# The beta client's scroll() walks ids 0 … get_vector_count(), so that count
+# is the whole id space: one call partitions it, no probing.
+
+SCAN_WORKERS = max(1, int(os.getenv("DB_SCAN_WORKERS", "8")))
+SCAN_PAGE = max(1, int(os.getenv("DB_SCAN_PAGE", "500")))
+SCAN_SPLIT = 4  # ranges per worker, so skewed id distributions still balance
+
+_scan_client = None
+_scan_client_lock = threading.Lock()
+
+def _shared_client():
+    """One long-lived client for scans; its gRPC channel pool is shared by all scan workers."""
+    global _scan_client
+    with _scan_client_lock:
+        if _scan_client is None:
+            from cortex import CortexClient
+            client = CortexClient(ACTIAN_HOST, pool_size=SCAN_WORKERS)
+            client.connect()
+            _scan_client = client
+        return _scan_client
+
+def _record_dict(r) -> dict:
+    """scroll() yields PointRecords; query() yields plain {"id": …, **payload} dicts."""
+    if isinstance(r, dict):
+        rest = {k: v for k, v in r.items() if k not in ("id", "vector")}
+        return {"_id": r["id"], **rest}
+    return {"_id": r.id, **(r.payload or {})}
+
+def _id_ranges(c, name: str, parts: int) -> List[tuple[int, int]]:
+    """Split [0, vector count) of a collection into `parts` half-open ranges."""
+    span = c.get_vector_count(name)
+    if not span:
+        return []
+    step = max(1, -(-span // parts))
+    return [(i * step, min(span, (i + 1) * step)) for i in range(parts) if i * step < span]
+
+def _scroll_range(c, name: str, start: int, end: int, page: int):
+    cursor = start
+    while cursor is not None and cursor < end:
+        records, cursor = c.scroll(name, limit=min(page, end - cursor), cursor=cursor)
+        batch = [d for d in map(_record_dict, records) if d["_id"] < end]
+        if batch:
+            yield batch
+
+def scan(collection: str, page_size: int = SCAN_PAGE, workers: int = SCAN_WORKERS) -> Iterator[dict]:
+    """Stream every record of `collection` (all shards), unordered."""
+    return _scan_physical(physical_collections(collection), page_size, workers)
+
+def _scan_physical(names: List[str], page_size: int = SCAN_PAGE, workers: int = SCAN_WORKERS) -> Iterator[dict]:
+    if not _USE_ACTIAN:
+        for name in names:
+            _mem_ensure(name)
+            items = list(_mem[name].items())
+            for i in range(0, len(items), page_size):
+                for rid, data in items[i:i + page_size]:
+                    yield {"_id": rid, **copy.deepcopy(data)}
+        return
+
+    c = _shared_client()
+    work: queue.Queue = queue.Queue()
+    for name in names:
+        for start, end in _id_ranges(c, name, workers * SCAN_SPLIT):
+            work.put((name, start, end))
+    if work.empty():
+        return
+    workers = max(1, min(workers, work.qsize()))
+    pages: queue.Queue = queue.Queue(maxsize=workers * 2)
+    stop = threading.Event()
+    done = object()
+
+    def emit(item) -> bool:
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def worker():
+        try:
+            while not stop.is_set():
+                try:
+                    name, start, end = work.get_nowait()
+                except queue.Empty:
+                    break
+                for batch in _scroll_range(c, name, start, end, page_size):
+                    if not emit(batch):
+                        return
+        except Exception as e:
+            emit(e)
+        finally:
+            emit(done)
+
+    threads = [threading.Thread(target=worker, daemon=True, name=f"db-scan-{i}") for i in range(workers)]
+    for t in threads:
+        t.start()
+    try:
+        finished = 0
+        while finished < len(threads):
+            item = pages.get()
+            if item is done:
+                finished += 1
+            elif isinstance(item, Exception):
+                raise RuntimeError(f"scan of {', '.join(names)} failed: {item}") from item
+            else:
+                yield from item
+    finally:
+        stop.set()
+
+def rebuild_cache():
+    """Rebuild the write-through lookup caches from a full scan of the backend."""
+    email_ids: dict[str, int] = {}
+    receipt_ids: dict[str, int] = {}
+    tx_rows: dict[str, list[tuple]] = {}
+    for col in ("user_wallets", "fraud_users", "verified_users"):
+        for r in scan(col):
+            if r.get("email"):
+                email_ids[r["email"]] = r["_id"]
+    for r in scan("claims"):
+        if r.get("receiptNumber"):
+            receipt_ids[r["receiptNumber"]] = r["_id"]
+    for r in scan("transactions"):
+        if r.get("email"):
+            tx_rows.setdefault(r["email"], []).append((r.get("seq", 0), r.get("timestamp", ""), r["_id"]))
+    _email_id_cache.clear(); _email_id_cache.update(email_ids)
+    _receipt_id_cache.clear(); _receipt_id_cache.update(receipt_ids)
+    _tx_email_cache.clear()
+    _tx_email_cache.update({email: [rid for *_, rid in sorted(rows)] for email, rows in tx_rows.items()})
+    _warm_shard_directory()
+    if _USE_ACTIAN:
+        _save_cache()
+    print(f"[db] Rebuilt cache: {len(email_ids)} users, {len(receipt_ids)} receipts, {len(tx_rows)} ledgers")
+
+if _USE_ACTIAN and not os.path.exists(CACHE_FILE):
+    try:
+        rebuild_cache()
+    except Exception as e:
+        print(f"[db] Cache rebuild failed, lookups will fall back to the backend: {e}")
+
+# ── Query planner ─────────────────────────────────────────
+# find_by/find_one pick the cheapest access path for (collection, field):
+#   bloom_negative – value was never written, answer "not found" immediately
+#                    (in-memory backend only, see below)
+#   unique_index  – write-through cache maps value -> one id
+#   multi_index   – write-through cache maps value -> list of ids
+#   server_filter – Cortex query() with a payload filter (opt-in)
+#   scan          – parallel full scan, filtered in app (logged)
+# Cache indexes are not authoritative (other writers, cold start), so a
+# miss falls through to the next path rather than returning "not found".
+# The beta client's query() ignores `filter` and returns the first `limit`
+# records, so server_filter stays off unless DB_SERVER_FILTER=1, and even
+# then an empty answer is treated as unknown and rechecked with a scan.
+
+SERVER_FILTER = os.getenv("DB_SERVER_FILTER", "0") not in ("0", "false", "no")
+
+_indexes: dict[tuple[str, str], dict] = {}
+_query_stats: dict[tuple[str, str, str], int] = {}
+
+def register_index(collection: str, field: str, kind: str, lookup):
+    """Register a cache-backed index. `lookup(value)` returns an id (unique) or ids (multi)."""
+    if kind not in ("unique", "multi"):
+        raise ValueError(f"Unknown index kind: {kind}")
+    _indexes[(collection, field)] = {"kind": kind, "lookup": lookup}
+
+for _col in ("verified_users", "fraud_users", "user_wallets"):
+    register_index(_col, "email", "unique", lambda v: _email_id_cache.get(v))
+register_index("claims", "receiptNumber", "unique", lambda v: _receipt_id_cache.get(v))
+register_index("transactions", "email", "multi", lambda v: _tx_email_cache.get(v))
+
+# ── Negative-lookup filters ──
+# A Bloom filter per (collection, field), fed on every write and rebuilt
+# from a full scan at startup. Until a rebuild has provably seen every
+# record (no scan error, row count matches the backend's vector count) a
+# filter is not "ready" and lookups fall through to the indexes.
+# In-memory backend only: the beta Cortex scroll never reaches the
+# time-based next_id() ids, so no scan of an Actian collection is complete
+# and a negative answer could hide a real record. Also disable with
+# DB_BLOOM=0 when other processes write to the same collections.
+
+BLOOM_ENABLED = not _USE_ACTIAN and os.getenv("DB_BLOOM", "1") not in ("0", "false", "no")
+
+_blooms: dict[tuple[str, str], dict] = {}
+
+def register_bloom(collection: str, field: str, capacity: int = 10_000):
+    _blooms[(collection, field)] = {
+        "filter": ScalableBloomFilter(initial_capacity=capacity),
+        # The in-memory store starts empty, so an empty filter is already exact
+        "ready": not _USE_ACTIAN,
+    }
+
+register_bloom("fraud_users", "email")
+register_bloom("verified_users", "email")
+register_bloom("claims", "receiptNumber")
+
+def _bloom_add(collection: str, payload: dict):
+    for (col, field), bloom in _blooms.items():
+        if col == collection and payload.get(field) is not None:
+            bloom["filter"].add(str(payload[field]))
+
+def might_contain(collection: str, field: str, value) -> bool:
+    """False only when `value` was definitely never written to collection.field."""
+    bloom = _blooms.get((collection, field))
+    if not BLOOM_ENABLED or not bloom or not bloom["ready"]:
+        return True
+    return str(value) in bloom["filter"]
+
+def _stored_count(collection: str) -> int:
+    """Records the backend holds for `collection`, across shards."""
+    if not _USE_ACTIAN:
+        return sum(len(_mem.get(n, {})) for n in physical_collections(collection))
+    c = _shared_client()
+    return sum(c.get_vector_count(n) for n in physical_collections(collection))
+
+def rebuild_blooms():
+    """Populate every registered filter from a full scan (one pass per collection)."""
+    if not BLOOM_ENABLED:
+        return
+    by_collection: dict[str, list] = {}
+    for (col, field), bloom in _blooms.items():
+        by_collection.setdefault(col, []).append((field, bloom))
+    for col, entries in by_collection.items():
+        started = time.time()
+        seen = 0
+        try:
+            expected = _stored_count(col)
+            for record in scan(col):
+                seen += 1
+                for field, bloom in entries:
+                    if record.get(field) is not None:
+                        bloom["filter"].add(str(record[field]))
+        except Exception as e:
+            print(f"[db] Bloom rebuild failed for {col}: {e}")
+            continue
+        if seen < expected:
+            print(f"[db] Bloom rebuild for {col} saw {seen} of {expected} records, filters stay off")
+            continue
+        for field, bloom in entries:
+            bloom["ready"] = True
+            print(f"[db] Bloom {col}.{field} ready: {bloom['filter'].stats()} in {time.time() - started:.2f}s")
+
+def bloom_stats() -> List[dict]:
+    return [
+        {"collection": col, "field": field, "enabled": BLOOM_ENABLED, "ready": b["ready"], **b["filter"].stats()}
+        for (col, field), b in _blooms.items()
+    ]
+
+def _target_shards(collection: str, field: str, value) -> List[str]:
+    if field == "email" and is_sharded(collection) and isinstance(value, str):
+        return [shard_name(collection, shard_for(value))]
+    return physical_collections(collection)
+
+def explain(collection: str, field: str, value) -> dict:
+    """Describe how find_by would execute, without touching the backend."""
+    plan = {"collection": collection, "field": field, "shards": _target_shards(collection, field, value)}
+    if not might_contain(collection, field, value):
+        return {**plan, "strategy": "bloom_negative"}
+    index = _indexes.get((collection, field))
+    if index:
+        hit = index["lookup"](value)
+        if hit:
+            ids = [hit] if index["kind"] == "unique" else list(hit)
+            return {**plan, "strategy": f"{index['kind']}_index", "ids": len(ids)}
+        plan["index_miss"] = f"{index['kind']}_index"
+    if _USE_ACTIAN and SERVER_FILTER:
+        return {**plan, "strategy": "server_filter"}
+    return {**plan, "strategy": "scan"}
+
+def query_stats() -> List[dict]:
+    return [
+        {"collection": c, "field": f, "strategy": s, "count": n}
+        for (c, f, s), n in sorted(_query_stats.items())
+    ]
+
+def _count(collection: str, field: str, strategy: str):
+    key = (collection, field, strategy)
+    _query_stats[key] = _query_stats.get(key, 0) + 1
+
+def _query_physical(name: str, field: str, value, limit: int) -> List[dict]:
+    records = _shared_client().query(name, filter=json.dumps({field: value}), limit=limit)
+    return [_record_dict(r) for r in records]
+
+def _run_scan(collection: str, field: str, value, limit: int, names: List[str]) -> List[dict]:
+    _count(collection, field, "scan")
+    print(f"[db] plan: SCAN {collection}.{field} over {len(names)} collection(s) "
+          f"– register an index for this lookup")
+    return list(itertools.islice((r for r in _scan_physical(names) if r.get(field) == value), limit))
+
+def find_by(collection: str, field: str, value, limit: int = 100) -> List[dict]:
+    plan = explain(collection, field, value)
+    strategy = plan["strategy"]
+
+    if strategy == "bloom_negative":
+        _count(collection, field, strategy)
+        return []
+
+    if strategy in ("unique_index", "multi_index"):
+        hit = _indexes[(collection, field)]["lookup"](value)
+        ids = [hit] if strategy == "unique_index" else list(hit)[-limit:]
+        records = [r for r in get_many(collection, ids) if r.get(field) == value]
+        if records:
+            _count(collection, field, strategy)
+            return records[:limit]
+        # Stale index entry: fall through to the backend
+        strategy = "server_filter" if _USE_ACTIAN and SERVER_FILTER else "scan"
+
+    if strategy == "server_filter":
+        try:
+            parts = _gather(lambda n: _query_physical(n, field, value, limit), plan["shards"])
+            records = [r for part in parts for r in part if r.get(field) == value][:limit]
+            if records:
+                _count(collection, field, strategy)
+                return records
+        except Exception as e:
+            print(f"[db] plan: server filter failed for {collection}.{field} ({e}), scanning")
+
+    return _run_scan(collection, field, value, limit, plan["shards"])
+
+def find_one(collection: str, field: str, value) -> Optional[dict]:
+    results = find_by(collection, field, value, limit=1)
+    return results[0] if results else None
 
 def health_info() -> dict:
     if _USE_ACTIAN:
@@ -383,7 +864,11 @@ def seed():
         "greenScore":800, "balance": 1000, "createdAt": now_iso()
     }
     put("verified_users", next_id(), admin)
-    put("user_wallets", next_id(), {"email": admin["email"], "balance": 1000})
+    # Wallet balances are derived from the ledger (see backend/ledger.py)
+    put("transactions", next_id(), {
+        "email": admin["email"], "type": "BONUS", "description": "Opening balance",
+        "amount": 1000.0, "timestamp": now_iso(), "seq": 1,
+    })
 
     # Seed marketplace
     mp_payloads = _marketplace_payloads()
@@ -0,0 +1,97 @@
+"""
+Text embeddings
+===============
+One embedder per process, picked by EMBEDDING_PROVIDER:
+  hash   – (default) local feature-hashed bag of words/bigrams, no network
+  gemini – Gemini text-embedding API, truncated to DIMENSION
+Vectors are L2-normalised float32 so cosine similarity is a dot product.
+Items and queries must use the same provider; switching providers
+requires re-indexing.
+"""
+
+import os, re, hashlib
+from functools import lru_cache
+from typing import List
+
+import httpx
+import numpy as np
+
+DIMENSION = 128  # matches services/actian_service.py
+PROVIDER = os.getenv("EMBEDDING_PROVIDER", "hash").lower()
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+GEMINI_EMBED_MODEL = os.getenv("GEMINI_EMBED_MODEL", "text-embedding-004")
+QUERY_CACHE_SIZE = int(os.getenv("EMBEDDING_QUERY_CACHE", "1024"))
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+class EmbedderUnavailable(Exception):
+    pass
+
+def normalize_rows(m: np.ndarray) -> np.ndarray:
+    """Unit-length rows (zero rows stay zero), as float32."""
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (m / norms).astype(np.float32)
+
+# ── Providers ──────────────────────────────────────────────
+
+def _hash_features(text: str) -> List[str]:
+    words = _TOKEN.findall(text.lower())
+    return words + [f"{a}_{b}" for a, b in zip(words, words[1:])]
+
+def _embed_hash(texts: List[str]) -> np.ndarray:
+    out = np.zeros((len(texts), DIMENSION), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for feat in _hash_features(text):
+            h = int.from_bytes(hashlib.blake2b(feat.encode("utf-8"), digest_size=8).digest(), "little")
+            out[row, h % DIMENSION] += 1.0 if (h >> 63) & 1 else -1.0
+    return normalize_rows(out)
+
+def _embed_gemini(texts: List[str]) -> np.ndarray:
+    if not GEMINI_API_KEY:
+        raise EmbedderUnavailable("GEMINI_API_KEY is not configured")
+    url = (f"https://generativelanguage.googleapis.com/v1beta/models/"
+           f"{GEMINI_EMBED_MODEL}:batchEmbedContents?key={GEMINI_API_KEY}")
+    body = {"requests": [
+        {
+            "model": f"models/{GEMINI_EMBED_MODEL}",
+            "content": {"parts": [{"text": t}]},
+            "outputDimensionality": DIMENSION,
+        }
+        for t in texts
+    ]}
+    try:
+        res = httpx.post(url, json=body, timeout=20)
+        res.raise_for_status()
+        values = [e["values"] for e in res.json()["embeddings"]]
+    except Exception as e:
+        raise EmbedderUnavailable(f"Gemini embedding failed: {e}")
+    return normalize_rows(np.asarray(values, dtype=np.float32)[:, :DIMENSION])
+
+# ── Public API ─────────────────────────────────────────────
+
+def embed(texts: List[str]) -> np.ndarray:
+    """Embed a batch of texts -> (len(texts), DIMENSION) float32 matrix."""
+    if not texts:
+        return np.zeros((0, DIMENSION), dtype=np.float32)
+    if PROVIDER == "gemini":
+        return _embed_gemini(texts)
+    return _embed_hash(texts)
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _embed_query_cached(text: str) -> tuple:
+    return tuple(embed([text])[0].tolist())
+
+def embed_query(text: str) -> np.ndarray:
+    """Embed a search query, served from an LRU for repeated queries."""
+    key = " ".join(text.lower().split())
+    return np.asarray(_embed_query_cached(key), dtype=np.float32)
+
+def query_cache_info() -> dict:
+    info = _embed_query_cached.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max": info.maxsize}
+
+def item_text(item: dict) -> str:
+    """Text used to embed a marketplace item."""
+    parts = [item.get("title", ""), item.get("brand", ""), item.get("description", ""), item.get("type", "")]
+    return " ".join(p for p in parts if p)
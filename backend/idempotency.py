@@ -0,0 +1,110 @@
+"""
+Idempotency keys
+================
+Retried POSTs carrying the same `Idempotency-Key` get the first response
+back instead of running the handler again. Keys are scoped per user and
+endpoint and kept in an in-process TTL store.
+
+  first request      → runs, result (or 4xx error) stored for IDEMPOTENCY_TTL
+  duplicate, done    → stored result replayed
+  duplicate, running → waits on the first execution, then replays it
+  same key, new body → IdempotencyConflict
+
+Unexpected errors (5xx) are not stored, so the client's next retry runs
+the handler again.
+"""
+
+import os, hashlib, json, threading, time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from fastapi import HTTPException
+
+TTL = float(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100000"))
+WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "30"))
+
+class IdempotencyConflict(Exception):
+    pass
+
+class _Entry:
+    __slots__ = ("fingerprint", "done", "result", "error", "expires")
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[HTTPException] = None
+        self.expires = float("inf")  # in-flight entries never expire
+
+_entries: "OrderedDict[str, _Entry]" = OrderedDict()
+_lock = threading.Lock()
+
+def fingerprint(payload) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def _evict(now: float):
+    while _entries:
+        key, entry = next(iter(_entries.items()))
+        if entry.expires < now or (len(_entries) > MAX_KEYS and entry.done.is_set()):
+            del _entries[key]
+        else:
+            break
+
+def run(scope: str, key: str, request_fingerprint: str, fn: Callable) -> tuple[object, bool]:
+    """Run `fn` once per (scope, key); returns (result, replayed)."""
+    store_key = f"{scope}:{key}"
+    while True:
+        now = time.time()
+        with _lock:
+            _evict(now)
+            entry = _entries.get(store_key)
+            if entry and entry.expires < now:
+                del _entries[store_key]
+                entry = None
+            if entry is None:
+                entry = _Entry(request_fingerprint)
+                _entries[store_key] = entry
+                owner = True
+            else:
+                owner = False
+        if entry.fingerprint != request_fingerprint:
+            raise IdempotencyConflict(key)
+
+        if owner:
+            try:
+                entry.result = fn()
+            except HTTPException as e:
+                if e.status_code >= 500:
+                    _abandon(store_key, entry)
+                    raise
+                entry.error = e
+            except Exception:
+                _abandon(store_key, entry)
+                raise
+            with _lock:
+                entry.expires = time.time() + TTL
+                _entries.move_to_end(store_key)
+            entry.done.set()
+            if entry.error:
+                raise entry.error
+            return entry.result, False
+
+        if not entry.done.wait(WAIT_TIMEOUT):
+            raise HTTPException(409, "A request with this Idempotency-Key is still in progress")
+        if entry.result is None and entry.error is None:
+            continue  # first execution failed; run it ourselves
+        if entry.error:
+            raise entry.error
+        return entry.result, True
+
+def _abandon(store_key: str, entry: _Entry):
+    with _lock:
+        if _entries.get(store_key) is entry:
+            del _entries[store_key]
+    entry.done.set()
+
+def stats() -> dict:
+    with _lock:
+        inflight = sum(1 for e in _entries.values() if not e.done.is_set())
+        return {"keys": len(_entries), "inflight": inflight}
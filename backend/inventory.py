@@ -0,0 +1,301 @@
+"""
+Inventory reservations
+======================
+Marketplace items with an `inventory` field are sold through short-lived
+reservations instead of read-modify-writes of the item record:
+
+  reserve → units move out of the item's striped counters (TTL hold)
+  commit  → reserved units become sold; sold counts are flushed to the
+            item's `inventory` in batches by a background thread
+  release → units go back (also done by the reaper when an unpinned hold
+            expires; checkout pins its hold so it cannot expire mid-sale)
+
+Each item's available units are split across INVENTORY_STRIPES counters
+with their own locks, so concurrent checkouts of one popular item mostly
+touch different stripes. A reservation draws from its home stripe first and
+borrows from the others only when that stripe runs dry.
+
+Items without an `inventory` field are unlimited and never tracked.
+Counters are per process; run one API worker per backend.
+"""
+
+import os, threading, time, uuid, itertools
+from typing import Optional, List
+
+from backend import db, catalog
+
+STRIPES = max(1, int(os.getenv("INVENTORY_STRIPES", "8")))
+RESERVATION_TTL = float(os.getenv("INVENTORY_RESERVATION_TTL", "120"))
+FLUSH_INTERVAL = float(os.getenv("INVENTORY_FLUSH_MS", "200")) / 1000
+
+class OutOfStock(Exception):
+    def __init__(self, item_id: int, requested: int, available: int):
+        super().__init__(f"item {item_id}: requested {requested}, available {available}")
+        self.item_id = item_id
+        self.requested = requested
+        self.available = available
+
+class ReservationNotFound(Exception):
+    pass
+
+_home = threading.local()
+_homes = itertools.count()
+
+def _home_stripe() -> int:
+    """Threads get home stripes round-robin (thread idents share their low bits)."""
+    stripe = getattr(_home, "stripe", None)
+    if stripe is None:
+        stripe = _home.stripe = next(_homes) % STRIPES
+    return stripe
+
+class _Counter:
+    """Available units of one item, split across striped sub-counters."""
+
+    def __init__(self, available: int):
+        self.locks = [threading.Lock() for _ in range(STRIPES)]
+        self.units = [0] * STRIPES
+        self.spread(available)
+
+    def spread(self, available: int):
+        # Callers hold every stripe lock (or own the counter exclusively)
+        base, extra = divmod(max(available, 0), STRIPES)
+        self.units = [base + (1 if i < extra else 0) for i in range(STRIPES)]
+
+    def take(self, qty: int) -> Optional[List[tuple[int, int]]]:
+        """Remove `qty` units; returns the (stripe, units) parts taken, or None."""
+        home = _home_stripe()
+        parts = []
+        need = qty
+        for i in range(STRIPES):
+            stripe = (home + i) % STRIPES
+            with self.locks[stripe]:
+                got = min(self.units[stripe], need)
+                if got:
+                    self.units[stripe] -= got
+                    parts.append((stripe, got))
+                    need -= got
+            if not need:
+                return parts
+        self.give(parts)
+        return None
+
+    def give(self, parts: List[tuple[int, int]]):
+        for stripe, units in parts:
+            with self.locks[stripe]:
+                self.units[stripe] += units
+
+    def available(self) -> int:
+        return sum(self.units)
+
+_counters: dict[int, _Counter] = {}
+_counters_lock = threading.Lock()
+_reservations: dict[str, dict] = {}
+_reservations_lock = threading.Lock()
+_held: dict[int, int] = {}      # item id -> units in live reservations
+_unflushed: dict[int, int] = {}  # item id -> units sold but not yet written
+_pending_lock = threading.Lock()
+_flushing = threading.local()
+_flusher: Optional[threading.Thread] = None
+
+# ── Counters ───────────────────────────────────────────────
+
+def _counter(item_id: int) -> Optional[_Counter]:
+    counter = _counters.get(item_id)
+    if counter is not None:
+        return counter
+    item = catalog.snapshot().by_id.get(item_id)
+    if not item or item.get("inventory") is None:
+        return None
+    with _counters_lock:
+        if item_id not in _counters:
+            _counters[item_id] = _Counter(int(item["inventory"]))
+        return _counters[item_id]
+
+def available(item_id: int) -> Optional[int]:
+    """Units that can be reserved now; None for untracked (unlimited) items."""
+    _reap()
+    counter = _counter(item_id)
+    return counter.available() if counter else None
+
+def _rebase(item_id: int, inventory: Optional[int]):
+    """Stock was changed outside this module (restock, admin edit, reseed)."""
+    with _counters_lock:
+        counter = _counters.get(item_id)
+        if counter is None:
+            return
+        if inventory is None:
+            del _counters[item_id]
+            return
+        for lock in counter.locks:
+            lock.acquire()
+        try:
+            with _pending_lock:
+                counter.spread(int(inventory) - _unflushed.get(item_id, 0) - _held.get(item_id, 0))
+        finally:
+            for lock in counter.locks:
+                lock.release()
+
+def _on_write(ids, payloads):
+    if getattr(_flushing, "active", False):
+        return  # our own batched commit
+    if ids is None:
+        with _counters_lock:
+            _counters.clear()
+        with _reservations_lock:
+            _reservations.clear()
+        with _pending_lock:
+            _unflushed.clear()
+            _held.clear()
+        return
+    for rid, payload in zip(ids, payloads):
+        _rebase(rid, payload.get("inventory") if payload else None)
+
+db.on_write(catalog.COLLECTION, _on_write)
+
+# ── Reservations ───────────────────────────────────────────
+
+def reserve(email: str, lines: List[tuple[int, int]], ttl: float = RESERVATION_TTL,
+            pin: bool = False) -> dict:
+    """Hold (item id, quantity) lines for `email`; all or nothing.
+
+    Raises OutOfStock for the first line that cannot be covered. A pinned
+    hold is never reaped; see get().
+    """
+    _reap()
+    taken: list[tuple[_Counter, int, list]] = []
+    wanted: dict[int, int] = {}
+    for item_id, qty in lines:
+        wanted[item_id] = wanted.get(item_id, 0) + qty
+    try:
+        for item_id, qty in wanted.items():
+            counter = _counter(item_id)
+            if counter is None:
+                continue
+            parts = counter.take(qty)
+            if parts is None:
+                raise OutOfStock(item_id, qty, counter.available())
+            taken.append((counter, item_id, parts))
+    except OutOfStock:
+        for counter, _, parts in taken:
+            counter.give(parts)
+        raise
+
+    res = {
+        "id": uuid.uuid4().hex,
+        "email": email,
+        "lines": [{"id": i, "quantity": q} for i, q in wanted.items()],
+        "parts": {item_id: parts for _, item_id, parts in taken},
+        "expiresAt": time.time() + ttl,
+        "pinned": pin,
+    }
+    with _pending_lock:
+        for item_id, parts in res["parts"].items():
+            _held[item_id] = _held.get(item_id, 0) + sum(u for _, u in parts)
+    with _reservations_lock:
+        _reservations[res["id"]] = res
+    return res
+
+def _pop(res_id: str, email: Optional[str] = None) -> dict:
+    with _reservations_lock:
+        res = _reservations.get(res_id)
+        if not res or (email is not None and res["email"] != email):
+            raise ReservationNotFound(res_id)
+        del _reservations[res_id]
+    with _pending_lock:
+        for item_id, parts in res["parts"].items():
+            _held[item_id] = _held.get(item_id, 0) - sum(u for _, u in parts)
+    return res
+
+def get(res_id: str, email: Optional[str] = None, pin: bool = False) -> dict:
+    """A live reservation. With pin=True the reaper leaves it alone until it is
+    committed, released or unpinned, so a hold can't expire mid-checkout."""
+    with _reservations_lock:
+        res = _reservations.get(res_id)
+        if not res or res["expiresAt"] < time.time() or (email is not None and res["email"] != email):
+            raise ReservationNotFound(res_id)
+        if pin:
+            res["pinned"] = True
+    return res
+
+def unpin(res_id: str):
+    """Hand a pinned hold back to its TTL (checkout failed, cart stays reserved)."""
+    with _reservations_lock:
+        res = _reservations.get(res_id)
+        if res:
+            res["pinned"] = False
+
+def release(res_id: str, email: Optional[str] = None):
+    res = _pop(res_id, email)
+    for item_id, parts in res["parts"].items():
+        counter = _counters.get(item_id)
+        if counter:
+            counter.give(parts)
+
+def commit(res_id: str, email: Optional[str] = None):
+    """Turn a hold into a sale; the item records are updated by the flusher."""
+    res = _pop(res_id, email)
+    with _pending_lock:
+        for item_id, parts in res["parts"].items():
+            _unflushed[item_id] = _unflushed.get(item_id, 0) + sum(u for _, u in parts)
+    _ensure_flusher()
+
+def _reap():
+    now = time.time()
+    with _reservations_lock:
+        expired = [rid for rid, r in _reservations.items() if r["expiresAt"] < now and not r["pinned"]]
+    for rid in expired:
+        try:
+            release(rid)
+        except ReservationNotFound:
+            pass
+
+# ── Batched commits ────────────────────────────────────────
+
+def flush() -> int:
+    """Write accumulated sales back to the item records in one batch."""
+    with _pending_lock:
+        sold = {i: n for i, n in _unflushed.items() if n}
+        _unflushed.clear()
+    if not sold:
+        return 0
+    items = catalog.snapshot().by_id
+    writes = []
+    for item_id, n in sold.items():
+        item = items.get(item_id)
+        if item and item.get("inventory") is not None:
+            payload = {k: v for k, v in item.items() if k != "_id"}
+            payload["inventory"] = max(int(item["inventory"]) - n, 0)
+            writes.append((catalog.COLLECTION, item_id, payload))
+    _flushing.active = True
+    try:
+        db.put_many(writes)
+    except Exception as e:
+        print(f"[inventory] Flush failed, will retry: {e}")
+        with _pending_lock:
+            for item_id, n in sold.items():
+                _unflushed[item_id] = _unflushed.get(item_id, 0) + n
+        return 0
+    finally:
+        _flushing.active = False
+    return len(writes)
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        _reap()
+        flush()
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is None:
+        with _counters_lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_loop, daemon=True, name="inventory-flush")
+                _flusher.start()
+
+def stats() -> dict:
+    with _reservations_lock:
+        live = len(_reservations)
+    with _pending_lock:
+        unflushed = sum(_unflushed.values())
+    return {"tracked": len(_counters), "reservations": live, "unflushed": unflushed, "stripes": STRIPES}
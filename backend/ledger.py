@@ -0,0 +1,144 @@
+"""
+Wallet Ledger – event-sourced balances
+=======================================
+`transactions` is the source of truth: every credit/debit is an append.
+A wallet balance is derived as  snapshot + sum(tail), where the snapshot
+(one record per user in `wallet_snapshots`) is rewritten every
+LEDGER_SNAPSHOT_EVERY appends. Nothing overwrites a shared wallet row.
+
+Legacy users that only have a `user_wallets` row are migrated on first
+read: the stored balance becomes their first snapshot.
+"""
+
+import os, threading
+from typing import Optional, List
+
+from backend import db
+
+SNAPSHOTS = "wallet_snapshots"
+SNAPSHOT_EVERY = int(os.getenv("LEDGER_SNAPSHOT_EVERY", "50"))
+
+class InsufficientBalance(Exception):
+    pass
+
+# head per email: {"balance", "seq", "lastTxId", "snapSeq"}
+_heads: dict[str, dict] = {}
+_heads_lock = threading.Lock()
+# Striped locks: appends for one user serialize, different users never contend
+_stripes = [threading.Lock() for _ in range(64)]
+
+def _lock_for(email: str) -> threading.Lock:
+    return _stripes[db.stable_id(email) % len(_stripes)]
+
+def reset_cache():
+    with _heads_lock:
+        _heads.clear()
+
+# ── Snapshot + tail ────────────────────────────────────────
+
+def _replay(txs: List[dict], balance: float = 0.0) -> float:
+    for tx in txs:
+        balance += float(tx.get("amount", 0) or 0)
+    return round(balance, 2)
+
+def _snapshot_write(email: str, head: dict) -> tuple[str, int, dict]:
+    head["snapSeq"] = head["seq"]
+    return (SNAPSHOTS, db.stable_id(email), {
+        "email": email,
+        "balance": head["balance"],
+        "seq": head["seq"],
+        "lastTxId": head["lastTxId"],
+        "at": db.now_iso(),
+    })
+
+def _write_snapshot(email: str, head: dict):
+    db.put(*_snapshot_write(email, head))
+
+def _history(email: str, tx_ids: List[int]) -> List[dict]:
+    """Every transaction of `email`, in append order."""
+    txs = db.get_many("transactions", tx_ids) if tx_ids else db.find_by("transactions", "email", email, limit=100000)
+    txs.sort(key=lambda t: t.get("seq", 0))
+    return txs
+
+def _load_head(email: str) -> dict:
+    tx_ids = db.tx_ids_for_email(email)
+    snap = db.get_by_id(SNAPSHOTS, db.stable_id(email))
+
+    if snap:
+        last = snap.get("lastTxId")
+        snap_seq = int(snap.get("seq", 0))
+        if last is None:
+            tail = db.get_many("transactions", tx_ids)
+        elif last in tx_ids:
+            tail = db.get_many("transactions", tx_ids[tx_ids.index(last) + 1:])
+        else:
+            # Snapshot predates our id cache: the tail is whatever was appended after its seq
+            tail = [t for t in _history(email, tx_ids) if int(t.get("seq", 0)) > snap_seq]
+        return {
+            "balance": _replay(tail, float(snap.get("balance", 0))),
+            "seq": snap_seq + len(tail),
+            "lastTxId": tail[-1]["_id"] if tail else last,
+            "snapSeq": snap_seq,
+        }
+
+    legacy = db.find_one("user_wallets", "email", email)
+    if legacy and not snap:
+        # Cut-over: the mutable wallet row was authoritative up to now
+        head = {
+            "balance": round(float(legacy.get("balance", 0)), 2),
+            "seq": len(tx_ids),
+            "lastTxId": tx_ids[-1] if tx_ids else None,
+            "snapSeq": 0,
+        }
+        print(f"[ledger] Migrated legacy wallet for {email}: {head['balance']}")
+        _write_snapshot(email, head)
+        return head
+
+    txs = _history(email, tx_ids)
+    return {
+        "balance": _replay(txs),
+        "seq": len(txs),
+        "lastTxId": txs[-1]["_id"] if txs else None,
+        "snapSeq": 0,
+    }
+
+def _head(email: str) -> dict:
+    head = _heads.get(email)
+    if head is None:
+        head = _load_head(email)
+        with _heads_lock:
+            _heads[email] = head
+    return head
+
+# ── Public API ─────────────────────────────────────────────
+
+def balance(email: str) -> float:
+    with _lock_for(email):
+        return _head(email)["balance"]
+
+def wallet(email: str) -> dict:
+    with _lock_for(email):
+        head = _head(email)
+        return {"email": email, "balance": head["balance"], "seq": head["seq"]}
+
+def append(email: str, tx: dict, require_funds: bool = False) -> tuple[int, float]:
+    """Append a transaction for `email` and return (tx_id, new_balance).
+
+    With `require_funds`, a debit that would take the balance below zero
+    raises InsufficientBalance and nothing is written.
+    """
+    amount = float(tx.get("amount", 0) or 0)
+    with _lock_for(email):
+        head = _head(email)
+        new_balance = round(head["balance"] + amount, 2)
+        if require_funds and new_balance < 0:
+            raise InsufficientBalance(f"balance {head['balance']} < {-amount}")
+        tx_id = db.next_id()
+        writes = [("transactions", tx_id, {**tx, "email": email, "seq": head["seq"] + 1})]
+        next_head = {**head, "balance": new_balance, "seq": head["seq"] + 1, "lastTxId": tx_id}
+        if next_head["seq"] - next_head["snapSeq"] >= SNAPSHOT_EVERY:
+            writes.append(_snapshot_write(email, next_head))
+        # Order transaction and (when due) the balance snapshot go out as one batch
+        db.put_many(writes)
+        head.update(next_head)
+        return tx_id, new_balance
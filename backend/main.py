@@ -1,21 +1,21 @@
-from fastapi import FastAPI, HTTPException, Depends, Header, UploadFile, File, Response
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, UploadFile, File, Response, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List
 import uvicorn
 import asyncio
 import os
-import jwt
 import json
 import re
 import sys
 import tempfile
+import threading
 import subprocess
-from datetime import datetime, timedelta
+from datetime import datetime
 from dotenv import load_dotenv
-import httpx
 
-from backend import db
+from backend import db, score_history, ledger, auth, catalog, search, embeddings, recommend, similar, inventory, idempotency, ai, receipt_image, receipt_parser, receipt_category, receipt_hash, receipt_match, analysis_cache, ocr_pool
 from backend.statement import generate_statement_pdf, generate_invoice_pdf
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -33,24 +33,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# ── JWT ────────────────────────────────────────────────────
-JWT_SECRET = os.getenv("JWT_SECRET", "secret")
-ALGORITHM = "HS256"
+# ── Config ─────────────────────────────────────────────────
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
-GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY", "")
 ELEVENLABS_STT_MODEL = os.getenv("ELEVENLABS_STT_MODEL", "scribe_v2")
 POINTS_PER_USD = float(os.getenv("POINTS_PER_USD", "0.5"))
-OCR_SCRIPT_PATH = os.path.join(PROJECT_ROOT, "services", "ocr_service.py")
-
-def create_token(email: str, role: str, user_id: int) -> str:
-    payload = {
-        "sub": email,
-        "uid": user_id,
-        "role": role,
-        "exp": datetime.utcnow() + timedelta(days=7)
-    }
-    return jwt.encode(payload, JWT_SECRET, algorithm=ALGORITHM)
+# Receipts whose weakest locally extracted field scores below this go to Gemini
+LOCAL_MIN_CONFIDENCE = float(os.getenv("LOCAL_MIN_CONFIDENCE", "0.7"))
+LOCAL_OCR_TIMEOUT = float(os.getenv("LOCAL_OCR_TIMEOUT", "10"))
+ANALYZE_BATCH_MAX = int(os.getenv("ANALYZE_BATCH_MAX", "40"))
+# Images analysed at once across all batch requests (OCR pool + Gemini queue behind this)
+ANALYZE_BATCH_CONCURRENCY = max(1, int(os.getenv("ANALYZE_BATCH_CONCURRENCY", "8")))
 
 # ── Models ─────────────────────────────────────────────────
 
@@ -91,6 +84,7 @@ class ClaimRequest(BaseModel):
     description: Optional[str] = None
     receiptNumber: str
     amount: float
+    analysisId: int  # from /api/claims/analyze-image
 
 class AiChatRequest(BaseModel):
     message: str
@@ -101,6 +95,10 @@ class CheckoutItem(BaseModel):
 
 class CheckoutRequest(BaseModel):
     items: List[CheckoutItem]
+    reservation_id: Optional[str] = None
+
+class ReserveRequest(BaseModel):
+    items: List[CheckoutItem]
 
 class ProfileUpdateRequest(BaseModel):
     name: Optional[str] = None
@@ -110,15 +108,93 @@ class ProfileUpdateRequest(BaseModel):
     state: Optional[str] = None
     zip: Optional[str] = None
 
+# ── Startup ────────────────────────────────────────────────
+
+@app.on_event("startup")
+def warm_lookup_filters():
+    # Full scans can take a while on big collections; lookups skip the filters until ready
+    threading.Thread(target=db.rebuild_blooms, daemon=True, name="bloom-rebuild").start()
+
+@app.on_event("shutdown")
+async def close_ai_client():
+    await ai.close()
+
+@app.on_event("startup")
+def schedule_taste_rebuild():
+    threading.Thread(target=recommend.run_periodically, daemon=True, name="taste-rebuild").start()
+
+@app.on_event("startup")
+def warm_receipt_hashes():
+    threading.Thread(target=receipt_hash.rebuild, daemon=True, name="receipt-hash-rebuild").start()
+
+@app.on_event("startup")
+def warm_receipt_numbers():
+    threading.Thread(target=receipt_match.rebuild, daemon=True, name="receipt-match-rebuild").start()
+
+@app.on_event("startup")
+def start_ocr_pool():
+    # Workers load the EasyOCR model in the background; the API is up meanwhile
+    if ocr_pool.available():
+        ocr_pool.start()
+    else:
+        print("[ocr] easyocr not installed; local OCR disabled")
+
+@app.on_event("shutdown")
+def stop_ocr_pool():
+    ocr_pool.stop()
+
+@app.on_event("shutdown")
+def flush_score_history():
+    score_history.flush()
+
 # ── Endpoints ──────────────────────────────────────────────
 
 @app.get("/api/health")
 def health():
     return db.health_info()
 
+@app.get("/api/db/explain")
+def db_explain(collection: str, field: str, value: str, authorization: str = Header(None)):
+    require_admin(authorization)
+    return db.explain(collection, field, value)
+
+@app.get("/api/db/query-stats")
+def db_query_stats(authorization: str = Header(None)):
+    require_admin(authorization)
+    return db.query_stats()
+
+@app.get("/api/ai/stats")
+def ai_stats(authorization: str = Header(None)):
+    require_admin(authorization)
+    return {**ai.stats(), "analysisCache": analysis_cache.stats(), "analysisTiers": _analysis_tiers,
+            "categoryClassifier": receipt_category.stats()}
+
+@app.get("/api/claims/hash-stats")
+def receipt_hash_stats(authorization: str = Header(None)):
+    require_admin(authorization)
+    return receipt_hash.stats()
+
+@app.get("/api/claims/match-stats")
+def receipt_match_stats(authorization: str = Header(None)):
+    require_admin(authorization)
+    return receipt_match.stats()
+
+@app.get("/api/ocr/stats")
+def ocr_stats(authorization: str = Header(None)):
+    require_admin(authorization)
+    return ocr_pool.stats()
+
+@app.get("/api/db/blooms")
+def db_blooms(authorization: str = Header(None)):
+    require_admin(authorization)
+    return db.bloom_stats()
+
 @app.post("/api/seed")
 def seed_db():
-    return db.seed()
+    result = db.seed()
+    ledger.reset_cache()
+    score_history.reset_cache()
+    return result
 
 # ── Auth ───────────────────────────────────────────────────
 
@@ -151,19 +227,16 @@ def signup(req: SignupRequest):
     }
     db.put("verified_users", uid, new_user)
     
-    # Create empty wallet with 100 free credits
-    db.put("user_wallets", uid, {"email": req.email, "balance": 100})
-    
-    # Record initial transaction (Welcome Bonus)
-    db.put("transactions", db.next_id(), {
-        "email": req.email,
+    # Welcome Bonus: 100 free credits (the wallet balance is derived from the ledger)
+    ledger.append(req.email, {
         "type": "BONUS",
         "description": "Account Created (Welcome Bonus)",
         "amount": 100.0,
         "timestamp": db.now_iso()
     })
     
-    token = create_token(req.email, "USER", uid)
+    auth.set_version(uid, 0)
+    token = auth.issue_token({**new_user, "_id": uid})
     return {"token": token, "user": {**new_user, "_id": uid}, "flow": "kyc"}
 
 @app.post("/api/auth/login")
@@ -190,7 +263,7 @@ def login(req: LoginRequest):
     if user["password"] != req.password:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    token = create_token(user["email"], user.get("role", "USER"), user["_id"])
+    token = auth.issue_token(user)
     
     # Determine flow
     if not user.get("kycComplete"):
@@ -200,23 +273,21 @@ def login(req: LoginRequest):
     
     return {"token": token, "user": user, "flow": "dashboard"}
 
-# Helper to get user from token
+# Helpers to get the caller from the token.
+# get_identity: uid/email/role/kyc/fraud from the signed token (no DB read when current)
+# get_user_from_header: full user record, only for handlers that need profile fields
+def get_identity(authorization: str):
+    return auth.get_identity(authorization)
+
 def get_user_from_header(authorization: str):
-    if not authorization: return None
-    try:
-        scheme, token = authorization.split()
-        if scheme.lower() != 'bearer': return None
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[ALGORITHM])
-        
-        # Try ID lookup first (Immediate consistency)
-        if "uid" in payload:
-            u = db.get_by_id("verified_users", payload["uid"])
-            if u: return u
-
-        # Fallback to email lookup
-        return db.find_one("verified_users", "email", payload["sub"])
-    except:
-        return None
+    return auth.get_user(authorization)
+
+def require_admin(authorization: str) -> dict:
+    """Caller's identity if it is an admin; 401/403 otherwise (planner and stock internals)."""
+    user = get_identity(authorization)
+    if not user: raise HTTPException(401, "Unauthorized")
+    if user.get("role") != "ADMIN": raise HTTPException(403, "Admin only")
+    return user
 
 @app.get("/api/auth/me")
 def me(authorization: str = Header(None)):
@@ -229,10 +300,6 @@ def get_profile(authorization: str = Header(None)):
     user = get_user_from_header(authorization)
     if not user: raise HTTPException(401, "Unauthorized")
     
-    # Get wallet
-    wallet = db.find_one("user_wallets", "email", user["email"])
-    if not wallet: wallet = {"balance": 0}
-    
     # Get transactions (history)
     txs = db.find_by("transactions", "email", user["email"], limit=50)
     # Sort by timestamp desc
@@ -240,7 +307,7 @@ def get_profile(authorization: str = Header(None)):
     
     return {
         "user": user,
-        "balance": wallet.get("balance", 0),
+        "balance": ledger.balance(user["email"]),
         "transactions": txs
     }
 
@@ -249,9 +316,7 @@ def download_statement(authorization: str = Header(None)):
     user = get_user_from_header(authorization)
     if not user: raise HTTPException(401, "Unauthorized")
     
-    # Get wallet
-    wallet = db.find_one("user_wallets", "email", user["email"])
-    if not wallet: wallet = {"balance": 0}
+    wallet = ledger.wallet(user["email"])
     
     # Get all transactions using the optimized lookup (same as UI)
     txs = db.get_transactions_by_email(user["email"])
@@ -312,10 +377,11 @@ def submit_kyc(req: KYCRequest, authorization: str = Header(None)):
     # Simulate CRS KYC check
     # In real world: call CRS API
     
-    updated_user = {**user, **req.dict(), "kycComplete": True}
+    # kycComplete is a token claim, so bump the version and hand out a fresh token
+    updated_user = auth.bump_version({**user, **req.dict(), "kycComplete": True})
     db.put("verified_users", user["_id"], updated_user)
     
-    return {"status": "success", "flow": "fraud"}
+    return {"status": "success", "flow": "fraud", "token": auth.issue_token(updated_user)}
 
 @app.post("/api/fraud")
 def check_fraud(req: FraudCheckRequest, authorization: str = Header(None)):
@@ -325,26 +391,31 @@ def check_fraud(req: FraudCheckRequest, authorization: str = Header(None)):
     # Simulate Fraud check
     # If IP starts with "666", flag as fraud
     if req.ip.startswith("666"):
-        # Move to fraud_users
+        # Move to fraud_users and revoke outstanding tokens
+        auth.revoke(user["_id"])
         db.delete_record("verified_users", user["_id"])
         db.put("fraud_users", user["_id"], {**user, "fraudClear": False, "fraudReason": "Suspicious IP"})
         raise HTTPException(403, "Fraud detected. Account locked.")
     
-    updated_user = {**user, "fraudClear": True, "fraudScore": 10} # Low risk
+    updated_user = auth.bump_version({**user, "fraudClear": True, "fraudScore": 10}) # Low risk
     db.put("verified_users", user["_id"], updated_user)
     
-    return {"status": "safe", "flow": "green-score"}
+    return {"status": "safe", "flow": "green-score", "token": auth.issue_token(updated_user)}
 
 # ── Internal score recalculation ───────────────────────────
 def _recalculate_green_score(user: dict) -> int:
-    """Dynamic green score: 600 base + activity bonuses (0-1000 scale)"""
+    """Dynamic green score: 600 base + activity bonuses (0-1000 scale)
+
+    `user` only needs identity fields; the full profile is loaded only when
+    the score changed and has to be written back.
+    """
     score = 600  # Base for all users
     if user.get("kycComplete"): score += 50
     if user.get("fraudClear"): score += 50
 
     email = user["email"]
     # +5 per green action claim, capped at +150
-    claims = db.find_by("claims", "email", email, limit=200)
+    claims = [c for c in db.find_by("claims", "email", email, limit=200) if c.get("status") != "FLAGGED"]
     claim_bonus = min(len(claims) * 5, 150)
     score += claim_bonus
 
@@ -357,137 +428,60 @@ def _recalculate_green_score(user: dict) -> int:
     score = min(score, 1000)  # Hard cap
 
     # Persist to user profile
-    updated_user = {**user, "greenScore": score}
-    db.put("verified_users", user["_id"], updated_user)
+    if score_history.latest(email) != score:
+        profile = db.get_by_id("verified_users", user["_id"])
+        if profile and profile.get("greenScore") != score:
+            db.put("verified_users", user["_id"], {**profile, "greenScore": score})
 
     # Save to history
-    db.put("green_scores", db.next_id(), {
-        "email": email, "score": score, "timestamp": db.now_iso()
-    })
+    score_history.append(email, score)
     return score
 
 @app.post("/api/green-score")
 def calc_green_score(authorization: str = Header(None)):
-    user = get_user_from_header(authorization)
+    user = get_identity(authorization)
     if not user: raise HTTPException(401, "Unauthorized")
     score = _recalculate_green_score(user)
     return {"score": score, "flow": "dashboard"}
 
 @app.get("/api/green-score/current")
 def get_green_score(authorization: str = Header(None)):
-    user = get_user_from_header(authorization)
+    user = get_identity(authorization)
     if not user: raise HTTPException(401, "Unauthorized")
     # Recalculate on read to ensure it's always fresh
     score = _recalculate_green_score(user)
     return {"score": score}
 
-# ── Image Analysis Helpers ─────────────────────────────────
-def _extract_amount_from_lines(lines: List[str], detected_total: float) -> float:
-    amounts: List[float] = []
-    prioritized: List[float] = []
-    money_regex = re.compile(r"\$?\s*([0-9]+(?:\.[0-9]{2}))")
-    priority_words = ("total", "amount", "paid", "balance", "due")
-    for line in lines:
-        lower = line.lower()
-        line_amounts: List[float] = []
-        for raw in money_regex.findall(line):
-            try:
-                value = float(raw)
-                if value > 0: line_amounts.append(value)
-            except Exception: continue
-        amounts.extend(line_amounts)
-        if line_amounts and any(word in lower for word in priority_words):
-            prioritized.extend(line_amounts)
-    if detected_total and detected_total > 0:
-        amounts.append(float(detected_total))
-        prioritized.append(float(detected_total))
-    if prioritized: return round(max(prioritized), 2)
-    if amounts: return round(max(amounts), 2)
-    for line in lines:
-        for raw in re.findall(r"\$\s*([0-9]+)", line):
-            try:
-                value = float(raw)
-                if value > 0: amounts.append(value)
-            except Exception: continue
-    if amounts: return round(max(amounts), 2)
-    if detected_total and detected_total > 0: return round(float(detected_total), 2)
-    return 0.0
-
-def _extract_receipt_number(lines: List[str]) -> str:
-    keyword = re.compile(
-        r"(?:receipt|invoice|order|txn|transaction|reference|ref|id|number|no\.?)\s*[:#-]?\s*([A-Z0-9-]{4,})",
-        re.IGNORECASE,
-    )
-    for line in lines:
-        match = keyword.search(line)
-        if match: return match.group(1).upper()
-    generic = re.compile(r"\b[A-Z0-9-]{6,}\b")
-    for idx, line in enumerate(lines):
-        if re.search(r"(receipt|invoice|order|txn|transaction|reference|ref|id|number|no\.?)", line, re.IGNORECASE):
-            if idx + 1 < len(lines):
-                match = generic.search(lines[idx + 1].upper())
-                if match: return match.group(0)
-    for line in lines:
-        match = generic.search(line.upper())
-        if match: return match.group(0)
-    from datetime import datetime as _dt
-    return f"OCR-{_dt.utcnow().strftime('%Y%m%d%H%M%S')}"
-
-def _extract_receipt_date(lines: List[str]) -> str:
-    merged = " ".join(lines)
-    candidates = [
-        (r"\b(\d{4}-\d{2}-\d{2})\b", ["%Y-%m-%d"]),
-        (r"\b(\d{2}/\d{2}/\d{4})\b", ["%m/%d/%Y"]),
-        (r"\b(\d{2}/\d{2}/\d{2})\b", ["%m/%d/%y"]),
-        (r"\b(\d{2}-\d{2}-\d{4})\b", ["%m-%d-%Y"]),
-    ]
-    for pattern, formats in candidates:
-        match = re.search(pattern, merged)
-        if not match: continue
-        raw = match.group(1)
-        for fmt in formats:
-            try:
-                from datetime import datetime as _dt
-                return _dt.strptime(raw, fmt).strftime("%Y-%m-%d")
-            except Exception: continue
-    from datetime import datetime as _dt
-    return _dt.utcnow().strftime("%Y-%m-%d")
-
-def _suggest_category(lines: List[str]) -> str:
-    text = " ".join(lines).lower()
-    mapping = [
-        ("EV charging", ["ev", "charger", "charging", "kwh", "supercharger", "chargepoint"]),
-        ("Bart", ["bart"]),
-        ("CalTrain", ["caltrain"]),
-        ("MUNI", ["muni"]),
-        ("Bike charging", ["bike", "bicycle"]),
-    ]
-    for category, keywords in mapping:
-        if any(keyword in text for keyword in keywords):
-            return category
-    return "EV charging"
-
-# ── Claims ─────────────────────────────────────────────
+@app.get("/api/green-score/history")
+def get_green_score_history(days: int = 365, points: int = 400, authorization: str = Header(None)):
+    user = get_identity(authorization)
+    if not user: raise HTTPException(401, "Unauthorized")
+    days = max(1, min(days, 3650))
+    points = max(10, min(points, 2000))
+    end = int(datetime.now().timestamp())
+    start = end - days * 86400
+    curve = score_history.query(user["email"], start, end, max_points=points)
+    return {"email": user["email"], "days": days, **curve}
 
-@app.post("/api/claims/analyze-image")
-async def analyze_claim_image(file: UploadFile = File(...), authorization: str = Header(None)):
-    user = get_user_from_header(authorization)
-    if not user:
-        raise HTTPException(401, "Unauthorized")
-    if not file:
-        raise HTTPException(400, "Image file is required")
+# ── Image Analysis Helpers ─────────────────────────────────
 
-    content = await file.read()
-    if not content:
-        raise HTTPException(400, "Uploaded image is empty")
+def _local_extract(ocr: dict) -> tuple[dict, dict]:
+    """Claim fields from local OCR output, plus a 0–1 confidence per field."""
+    lines = [l["text"] for l in ocr.get("lines", [])]
+    confs = [l["confidence"] for l in ocr.get("lines", [])]
+    ocr_conf = sum(confs) / len(confs) if confs else 0.0
+    result, confidence = receipt_parser.parse(lines)
+    # Category by nearest centroid; the parser's keyword match only if the embedder is down
+    category = receipt_category.classify("\n".join(lines))
+    if category:
+        result["category"], confidence["category"] = category
+    # Parser confidence is about how a value was found; scale by how well it was read
+    return result, {k: round(v * ocr_conf, 3) for k, v in confidence.items()}
 
-    try:
-        from google import genai
-        from google.genai import types
+# ── Claims ─────────────────────────────────────────────
 
-        client = genai.Client(api_key=GEMINI_API_KEY)
-        
-        prompt = """
+# Part of the analysis cache key: editing the prompt invalidates cached results
+RECEIPT_PROMPT = """
         Analyze this receipt/invoice image and extract the following details in strict JSON format:
         {
             "category": "One of [Bart, CalTrain, MUNI, Bike charging, EV charging] or infer best fit",
@@ -498,188 +492,516 @@ async def analyze_claim_image(file: UploadFile = File(...), authorization: str =
             "estimatedPoints": float (calculated as amount * 3.0)
         }
         """
-        
-        # Convert content to proper format for new SDK
-        # generated_content accepts bytes directly in Part?
-        # Or types.Part.from_bytes(data, mime_type)
-        
-        response = client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=[
-                prompt,
-                types.Part.from_bytes(data=content, mime_type=file.content_type or "image/jpeg")
-            ]
-        )
-        
-        # Clean response
-        text = response.text.strip()
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.endswith("```"):
-            text = text[:-3]
-            
-        data = json.loads(text)
-        
-        # Ensure fields
-        amount = float(data.get("amount", 0.0))
-        points = round(amount * POINTS_PER_USD, 2) 
-        
-        return {
-            "status": "ok",
-            "category": data.get("category", "EV charging"),
-            "date": data.get("date", datetime.now().strftime("%Y-%m-%d")),
-            "receiptNumber": data.get("receiptNumber", "N/A"),
-            "amount": amount,
-            "estimatedPoints": points,
-            "description": data.get("description", "Uploaded receipt"),
-            "model": "gemini-flash-v2"
-        }
 
+# Part of the cache key for local-tier results: bump when receipt_parser,
+# receipt_category or the OCR pass change what the local tier extracts
+LOCAL_EXTRACTOR_VERSION = "1"
+
+def _cache_keys(image_bytes: bytes) -> tuple[str, str]:
+    """(Gemini-tier key, local-tier key) for one image."""
+    return (analysis_cache.key(image_bytes, ai.GEMINI_MODEL, RECEIPT_PROMPT),
+            analysis_cache.key(image_bytes, f"easyocr-local-v{LOCAL_EXTRACTOR_VERSION}",
+                               f"min-confidence={LOCAL_MIN_CONFIDENCE}"))
+
+_analysis_tiers: dict = {}  # how many analyses each tier answered
+
+def _analysis_response(result: dict, source: str) -> dict:
+    tier = "cache" if source == "cache" else result.get("tier", "gemini")
+    _analysis_tiers[tier] = _analysis_tiers.get(tier, 0) + 1
+    return {
+        "status": "ok",
+        **result,
+        # Points follow the current conversion rate, not the one at caching time
+        "estimatedPoints": round(result["amount"] * POINTS_PER_USD, 2),
+        "model": result.get("model", "gemini-flash-v2"),
+        "tier": result.get("tier", "gemini"),
+        "source": source,
+    }
+
+async def _analyze_local(prepared) -> Optional[dict]:
+    """Tier 1: EasyOCR on the warm pool, regex extractors and the category classifier. None if OCR can't run."""
+    if not ocr_pool.available():
+        return None
+    try:
+        ocr = await ocr_pool.ocr(prepared.data, timeout=LOCAL_OCR_TIMEOUT)
     except Exception as e:
+        print(f"[analyze] Local OCR skipped: {e}")
+        return None
+    # The embedder may be a network call
+    result, confidence = await asyncio.to_thread(_local_extract, ocr)
+    return {**result, "confidence": confidence, "model": "easyocr", "tier": "local"}
+
+async def _analyze_gemini(prepared, mime_type: str) -> dict:
+    """Tier 2: Gemini on the preprocessed image."""
+    # Shared async client: the model call doesn't hold up the event loop
+    response = await ai.generate([
+        RECEIPT_PROMPT,
+        ai.image_part(prepared.data, mime_type),
+    ])
+
+    # Clean response
+    text = response.text.strip()
+    if text.startswith("```json"):
+        text = text[7:]
+    if text.endswith("```"):
+        text = text[:-3]
+
+    data = json.loads(text)
+
+    # Ensure fields
+    return {
+        "category": data.get("category", "EV charging"),
+        "date": data.get("date", datetime.now().strftime("%Y-%m-%d")),
+        "receiptNumber": data.get("receiptNumber", "N/A"),
+        "amount": float(data.get("amount", 0.0)),
+        "description": data.get("description", "Uploaded receipt"),
+        "tier": "gemini",
+    }
+
+async def _analyze_receipt(content: bytes, content_type: Optional[str]) -> dict:
+    # Identical re-uploads are answered from the content-addressed cache
+    raw_keys = _cache_keys(content)
+    cached = await asyncio.to_thread(analysis_cache.get, *raw_keys)
+    if cached:
+        return _analysis_response(cached, "cache")
+
+    # Shrink the photo first (CPU-bound, so off the event loop)
+    prepared = await asyncio.to_thread(receipt_image.preprocess, content)
+    mime_type = prepared.mime_type if prepared.image is not None else (content_type or "image/jpeg")
+    # Perceptual hash of the normalised image, for near-duplicate checks at claim time
+    image_hash = {"imageHash": receipt_hash.to_hex(receipt_hash.dhash(prepared.image))} if prepared.image is not None else {}
+
+    norm_keys = _cache_keys(prepared.data)
+    cached = await asyncio.to_thread(analysis_cache.get, *norm_keys)
+    if cached:
+        cached = {**cached, **image_hash}
+        raw_key = raw_keys[1] if cached.get("tier") == "local" else raw_keys[0]
+        await asyncio.to_thread(analysis_cache.put, [raw_key], cached)
+        return _analysis_response(cached, "cache")
+
+    # Local OCR first; Gemini only when some field is uncertain
+    local = await _analyze_local(prepared)
+    if local:
+        local.update(image_hash)
+    if local and min(local["confidence"].values()) >= LOCAL_MIN_CONFIDENCE:
+        await asyncio.to_thread(analysis_cache.put, [raw_keys[1], norm_keys[1]], local)
+        return _analysis_response(local, "model")
+
+    try:
+        result = await _analyze_gemini(prepared, mime_type)
+    except Exception as e:
+        if local:
+            # Better a low-confidence local draft than no draft; the user reviews it anyway
+            print(f"[analyze] Gemini failed ({e}); returning local result")
+            return _analysis_response({**local, "tier": "local-fallback"}, "model")
+        if isinstance(e, ai.GeminiUnavailable):
+            raise HTTPException(503, str(e))
         print(f"Gemini analysis failed: {e}")
         raise HTTPException(502, f"AI analysis failed: {str(e)}")
-    finally:
-        pass
+    result.update(image_hash)
+    await asyncio.to_thread(analysis_cache.put, [raw_keys[0], norm_keys[0]], result)
+    return _analysis_response(result, "model")
+
+def _screen_analysis(user: dict, result: dict) -> dict:
+    """Store the analysis for the claim to cite and warn early about near-duplicates."""
+    h = receipt_hash.from_hex(result.pop("imageHash", None))
+    result["analysisId"] = receipt_hash.record_analysis(user["email"], h, result.get("amount"), result.get("date"))
+    if h is None:
+        return result
+    duplicates = receipt_hash.find_duplicates(h, result.get("amount"), result.get("date"))
+    if duplicates:
+        result["duplicateOf"] = [d["claimId"] for d in duplicates]
+        result["warning"] = "This receipt looks like one that was already claimed; it will be held for review."
+    return result
+
+@app.post("/api/claims/analyze-image")
+async def analyze_claim_image(file: UploadFile = File(...), authorization: str = Header(None)):
+    user = get_identity(authorization)
+    if not user:
+        raise HTTPException(401, "Unauthorized")
+    if not file:
+        raise HTTPException(400, "Image file is required")
+
+    content = await file.read()
+    if not content:
+        raise HTTPException(400, "Uploaded image is empty")
+    return _screen_analysis(user, await _analyze_receipt(content, file.content_type))
+
+_batch_semaphore = asyncio.Semaphore(ANALYZE_BATCH_CONCURRENCY)
+
+@app.post("/api/claims/analyze-batch")
+async def analyze_claim_batch(files: List[UploadFile] = File(...), authorization: str = Header(None)):
+    """Analyse many receipts at once; one NDJSON line per image, in completion order."""
+    user = get_identity(authorization)
+    if not user:
+        raise HTTPException(401, "Unauthorized")
+    if not files:
+        raise HTTPException(400, "At least one image is required")
+    if len(files) > ANALYZE_BATCH_MAX:
+        raise HTTPException(413, f"At most {ANALYZE_BATCH_MAX} images per batch")
+
+    # Read everything up front: the uploads are closed once this handler returns
+    uploads = [(i, f.filename, f.content_type, await f.read()) for i, f in enumerate(files)]
+
+    async def analyze_one(index: int, filename: str, content_type: Optional[str], content: bytes) -> dict:
+        head = {"index": index, "filename": filename}
+        if not content:
+            return {**head, "status": "error", "code": 400, "detail": "Uploaded image is empty"}
+        async with _batch_semaphore:
+            try:
+                return {**head, **_screen_analysis(user, await _analyze_receipt(content, content_type))}
+            except HTTPException as e:
+                return {**head, "status": "error", "code": e.status_code, "detail": e.detail}
+            except Exception as e:
+                print(f"[analyze] Batch item {index} failed: {e}")
+                return {**head, "status": "error", "code": 500, "detail": str(e)}
+
+    async def stream():
+        tasks = [asyncio.create_task(analyze_one(*u)) for u in uploads]
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield json.dumps(await done) + "\n"
+        finally:
+            # Client went away: don't keep spending OCR/Gemini time on its batch
+            for t in tasks:
+                t.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post("/api/claims/ocr")
+async def ocr_claim_image(file: UploadFile = File(...), authorization: str = Header(None)):
+    user = get_identity(authorization)
+    if not user:
+        raise HTTPException(401, "Unauthorized")
+    content = await file.read()
+    if not content:
+        raise HTTPException(400, "Uploaded image is empty")
+    try:
+        return {"status": "ok", **await ocr_pool.ocr(content)}
+    except ocr_pool.OCRTimeout as e:
+        raise HTTPException(504, str(e))
+    except ocr_pool.OCRUnavailable as e:
+        raise HTTPException(503, str(e))
+    except Exception as e:
+        print(f"OCR failed: {e}")
+        raise HTTPException(502, f"OCR failed: {str(e)}")
+
+def _idempotent(response: Response, user: dict, endpoint: str, key: Optional[str], payload, fn):
+    """Run a write handler at most once per Idempotency-Key (see backend/idempotency.py)."""
+    if not key:
+        return fn()
+    try:
+        result, replayed = idempotency.run(f"{user['_id']}:{endpoint}", key, idempotency.fingerprint(payload), fn)
+    except idempotency.IdempotencyConflict:
+        raise HTTPException(422, "Idempotency-Key was already used with a different request")
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
 
 @app.post("/api/claims")
-def submit_claim(req: ClaimRequest, authorization: str = Header(None)):
-    user = get_user_from_header(authorization)
+def submit_claim(req: ClaimRequest, response: Response, authorization: str = Header(None),
+                 idempotency_key: Optional[str] = Header(None)):
+    user = get_identity(authorization)
     if not user: raise HTTPException(401, "Unauthorized")
-    
-    
+    return _idempotent(response, user, "claims", idempotency_key, req.model_dump(),
+                       lambda: _submit_claim(user, req))
+
+def _submit_claim(user: dict, req: ClaimRequest):
     # Check for duplicate receipt
     if db.find_one("claims", "receiptNumber", req.receiptNumber):
         raise HTTPException(status_code=400, detail="Duplicate receipt number. Claim rejected.")
 
-    # Credits logic: configurable conversion
-    points = round(req.amount * POINTS_PER_USD, 2)
-    
-    # Save claim
-    claim = {
-        "email": user["email"],
-        "category": req.category,
-        "date": req.date,
-        "description": req.description,
-        "receiptNumber": req.receiptNumber,
-        "amount": req.amount,
-        "pointsAwarded": points,
-        "status": "APPROVED",
-        "timestamp": db.now_iso()
-    }
-    db.put("claims", db.next_id(), claim)
+    # The claim must cite this user's own analysis of the photo; the image
+    # hash comes from the server's copy, not the request
+    claim_id = db.next_id()
+    analysis = receipt_hash.use_analysis(req.analysisId, user["email"], claim_id)
+    if analysis is None:
+        raise HTTPException(400, "Unknown, expired or already used receipt analysis. Upload the receipt again.")
+
+    try:
+        # Near-duplicate photo of an earlier claim: record it, but hold the points for review
+        image_hash = receipt_hash.from_hex(analysis.get("imageHash"))
+        duplicates = []
+        if image_hash is not None:
+            duplicates = receipt_hash.check_and_add(image_hash, claim_id, req.amount, req.date)
+
+        # Receipt number misread by a character or two: same normalised key, or
+        # within a few edits with the same amount and date, is held the same way
+        near = receipt_match.check_and_add(req.receiptNumber, claim_id, req.amount, req.date)
+        same = (round(req.amount, 2), req.date)
+        duplicate_ids = [d["claimId"] for d in duplicates]
+        for m in near:
+            if (m["distance"] == 0 or (m["amount"], m["date"]) == same) and m["claimId"] not in duplicate_ids:
+                duplicate_ids.append(m["claimId"])
+        near_matches = [{"claimId": m["claimId"], "distance": m["distance"]} for m in near]
+        flagged = bool(duplicate_ids)
+
+        # Credits logic: configurable conversion
+        points = 0 if flagged else round(req.amount * POINTS_PER_USD, 2)
     
-    # Update wallet
-    wallet = db.find_one("user_wallets", "email", user["email"])
-    if not wallet:
-        wallet = {"email": user["email"], "balance": 0}
-        
-    new_balance = wallet.get("balance", 0) + points
-    db.put("user_wallets", int(wallet.get("_id", db.next_id())), {**wallet, "balance": new_balance})
+        # Save claim
+        claim = {
+            "email": user["email"],
+            "category": req.category,
+            "date": req.date,
+            "description": req.description,
+            "receiptNumber": req.receiptNumber,
+            "amount": req.amount,
+            "pointsAwarded": points,
+            "status": "FLAGGED" if flagged else "APPROVED",
+            "analysisId": req.analysisId,
+            "imageHash": analysis.get("imageHash"),
+            "duplicateOf": duplicate_ids,
+            "nearMatches": near_matches,
+            "timestamp": db.now_iso()
+        }
+        db.put("claims", claim_id, claim)
+    except Exception:
+        # Nothing was stored: drop the claim from the duplicate indexes and free
+        # the analysis, so a retry is not flagged against a phantom claim
+        receipt_hash.discard(claim_id)
+        receipt_match.discard(claim_id)
+        receipt_hash.release_analysis(req.analysisId, claim_id)
+        raise
+    if flagged:
+        print(f"[claims] Claim {claim_id} flagged: near-duplicate of {claim['duplicateOf']}")
+        return {"status": "flagged", "points": 0, "balance": ledger.wallet(user["email"])["balance"],
+                "duplicateOf": duplicate_ids, "nearMatches": near_matches}
     
-    # Record transaction
-    tx = {
-        "email": user["email"],
+    # Credit wallet (ledger append)
+    _, new_balance = ledger.append(user["email"], {
         "type": "EARN",
         "description": f"Claim: {req.category} (#{req.receiptNumber})",
         "amount": points,
         "timestamp": db.now_iso()
-    }
-    db.put("transactions", db.next_id(), tx)
+    })
 
     # Recalculate green score after earning
     _recalculate_green_score(user)
     
-    return {"status": "approved", "points": points, "balance": new_balance}
+    return {"status": "approved", "points": points, "balance": new_balance, "nearMatches": near_matches}
 
 
 
 # ── Marketplace ────────────────────────────────────────────
 
 @app.get("/api/marketplace")
-def get_marketplace(type: Optional[str] = None):
-    items = db.get_all("marketplace")
-    if type:
-        items = [i for i in items if i.get("type") == type]
-    return items
+def get_marketplace(
+    response: Response,
+    type: Optional[str] = None,
+    sort: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    if_none_match: Optional[str] = Header(None),
+):
+    snap = catalog.snapshot()
+    if if_none_match and snap.etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": snap.etag})
+    items = snap.view(type, sort)
+    page = items[offset:offset + limit] if limit is not None else items[offset:]
+    response.headers["ETag"] = snap.etag
+    response.headers["X-Total-Count"] = str(len(items))
+    return page
+
+@app.get("/api/marketplace/search")
+def search_marketplace(
+    q: str,
+    type: Optional[str] = None,
+    max_cost: Optional[float] = None,
+    include_inactive: bool = False,
+    limit: int = 10,
+):
+    if not q.strip():
+        raise HTTPException(400, "Query is empty")
+    try:
+        results = search.search(q, type=type, max_cost=max_cost,
+                                active=None if include_inactive else True,
+                                limit=max(1, min(limit, 50)))
+    except embeddings.EmbedderUnavailable as e:
+        raise HTTPException(503, str(e))
+    return {"query": q, "results": results}
+
+@app.get("/api/marketplace/recommended")
+def recommended_items(limit: int = 10, authorization: str = Header(None)):
+    user = get_identity(authorization)
+    if not user: raise HTTPException(401, "Unauthorized")
+    try:
+        return recommend.recommend(user, limit=max(1, min(limit, 50)))
+    except embeddings.EmbedderUnavailable as e:
+        raise HTTPException(503, str(e))
+
+@app.get("/api/marketplace/inventory/stats")
+def inventory_stats(authorization: str = Header(None)):
+    require_admin(authorization)
+    return inventory.stats()
+
+@app.get("/api/marketplace/search/stats")
+def search_stats(authorization: str = Header(None)):
+    require_admin(authorization)
+    return search.stats()
+
+@app.get("/api/marketplace/{item_id}/similar")
+def similar_items(item_id: int, limit: int = 6):
+    if item_id not in catalog.snapshot().by_id:
+        raise HTTPException(404, "Item not found")
+    try:
+        hits = similar.neighbors(item_id, limit=max(1, min(limit, similar.K)))
+    except embeddings.EmbedderUnavailable as e:
+        raise HTTPException(503, str(e))
+    return {"item_id": item_id, "items": search.hydrate(hits)}
 
 @app.post("/api/marketplace/redeem")
-def redeem_item(item_id: int, authorization: str = Header(None)):
-    user = get_user_from_header(authorization)
+def redeem_item(item_id: int, response: Response, authorization: str = Header(None),
+                idempotency_key: Optional[str] = Header(None)):
+    user = get_identity(authorization)
     if not user: raise HTTPException(401, "Unauthorized")
-    
-    item = db.get_by_id("marketplace", item_id)
+    return _idempotent(response, user, "redeem", idempotency_key, {"item_id": item_id},
+                       lambda: _redeem_item(user, item_id))
+
+def _redeem_item(user: dict, item_id: int):
+    item = catalog.get(item_id)
     if not item: raise HTTPException(404, "Item not found")
     
     cost = item.get("cost", 0)
+    try:
+        hold = inventory.reserve(user["email"], [(item_id, 1)], pin=True)
+    except inventory.OutOfStock:
+        raise HTTPException(409, "Out of stock")
     
-    # Check balance
-    wallet = db.find_one("user_wallets", "email", user["email"])
-    if not wallet or wallet.get("balance", 0) < cost:
-        raise HTTPException(400, "Insufficient balance")
-        
-    # Deduct
-    new_balance = wallet["balance"] - cost
-    db.put("user_wallets", wallet["_id"], {**wallet, "balance": new_balance})
-    
-    # Record transaction
-    tx = {
-        "email": user["email"],
-        "type": "SPEND",
-        "description": f"Redeemed: {item['title']}",
-        "amount": -cost,
-        "timestamp": db.now_iso()
-    }
-    db.put("transactions", db.next_id(), tx)
+    # Deduct (balance check and append are atomic per user)
+    try:
+        _, new_balance = ledger.append(user["email"], {
+            "type": "SPEND",
+            "description": f"Redeemed: {item['title']}",
+            "amount": -cost,
+            "timestamp": db.now_iso(),
+            "item_id": item_id,
+        }, require_funds=True)
+    except Exception as e:
+        inventory.release(hold["id"])
+        if isinstance(e, ledger.InsufficientBalance):
+            raise HTTPException(400, "Insufficient balance")
+        raise
+    inventory.commit(hold["id"])
     
     return {"status": "success", "new_balance": new_balance}
 
+def _cart_lines(items: List[CheckoutItem]) -> dict[int, int]:
+    lines: dict[int, int] = {}
+    for ci in items:
+        if ci.quantity < 1:
+            raise HTTPException(400, "Quantity must be at least 1")
+        lines[ci.id] = lines.get(ci.id, 0) + ci.quantity
+    return lines
+
+@app.post("/api/marketplace/reserve")
+def reserve_items(req: ReserveRequest, authorization: str = Header(None)):
+    user = get_identity(authorization)
+    if not user: raise HTTPException(401, "Unauthorized")
+    if not req.items: raise HTTPException(400, "Cart is empty")
+    lines = _cart_lines(req.items)
+    items_by_id = catalog.snapshot().by_id
+    missing = [i for i in lines if i not in items_by_id]
+    if missing:
+        raise HTTPException(404, f"Item {missing[0]} not found")
+    try:
+        hold = inventory.reserve(user["email"], list(lines.items()))
+    except inventory.OutOfStock as e:
+        raise HTTPException(409, f"Item {e.item_id} has only {e.available} left")
+    return {
+        "reservation_id": hold["id"],
+        "items": hold["lines"],
+        "expiresAt": datetime.fromtimestamp(hold["expiresAt"]).isoformat(),
+    }
+
+@app.delete("/api/marketplace/reserve/{reservation_id}")
+def release_reservation(reservation_id: str, authorization: str = Header(None)):
+    user = get_identity(authorization)
+    if not user: raise HTTPException(401, "Unauthorized")
+    try:
+        inventory.release(reservation_id, user["email"])
+    except inventory.ReservationNotFound:
+        raise HTTPException(404, "Reservation not found or expired")
+    return {"status": "released"}
+
 @app.post("/api/checkout")
-def checkout(req: CheckoutRequest, authorization: str = Header(None)):
-    user = get_user_from_header(authorization)
+def checkout(req: CheckoutRequest, background: BackgroundTasks, response: Response,
+             authorization: str = Header(None), idempotency_key: Optional[str] = Header(None)):
+    user = get_identity(authorization)
     if not user: raise HTTPException(401, "Unauthorized")
+    return _idempotent(response, user, "checkout", idempotency_key, req.model_dump(),
+                       lambda: _checkout(user, req, background))
+
+def _checkout(user: dict, req: CheckoutRequest, background: BackgroundTasks):
     if not req.items: raise HTTPException(400, "Cart is empty")
 
-    # Resolve items and compute total
+    # Resolve every cart line against one catalog snapshot and compute total
+    items_by_id = catalog.snapshot().by_id
+    missing = [ci.id for ci in req.items if ci.id not in items_by_id]
+    if missing:
+        raise HTTPException(404, f"Item {missing[0]} not found")
     order_items = []
     total_cost = 0
     for ci in req.items:
-        item = db.get_by_id("marketplace", ci.id)
-        if not item:
-            raise HTTPException(404, f"Item {ci.id} not found")
+        item = items_by_id[ci.id]
         cost = item.get("cost", 0) * ci.quantity
         total_cost += cost
         order_items.append({
+            "id": ci.id,
             "title": item.get("title", "Unknown"),
             "quantity": ci.quantity,
             "cost": item.get("cost", 0),
         })
 
-    # Check balance
-    wallet = db.find_one("user_wallets", "email", user["email"])
-    if not wallet or wallet.get("balance", 0) < total_cost:
-        raise HTTPException(400, "Insufficient balance")
-
-    # Deduct
-    new_balance = wallet["balance"] - total_cost
-    db.put("user_wallets", wallet["_id"], {**wallet, "balance": new_balance})
-
-    # Create order transaction
+    # Hold stock: use the cart's reservation, or reserve now
+    lines = _cart_lines(req.items)
+    if req.reservation_id:
+        try:
+            hold = inventory.get(req.reservation_id, user["email"])
+        except inventory.ReservationNotFound:
+            raise HTTPException(409, "Reservation not found or expired")
+        if {l["id"]: l["quantity"] for l in hold["lines"]} != lines:
+            raise HTTPException(409, "Cart does not match reservation")
+        try:
+            hold = inventory.get(req.reservation_id, user["email"], pin=True)
+        except inventory.ReservationNotFound:
+            raise HTTPException(409, "Reservation not found or expired")
+    else:
+        try:
+            hold = inventory.reserve(user["email"], list(lines.items()), pin=True)
+        except inventory.OutOfStock as e:
+            raise HTTPException(409, f"Item {e.item_id} has only {e.available} left")
+
+    # Deduct via an order transaction (balance check and append are atomic per user)
     order_id = db.cuid()
     ts = db.now_iso()
     item_names = ", ".join(f"{oi['title']} x{oi['quantity']}" for oi in order_items)
-    tx = {
-        "email": user["email"],
-        "type": "SPEND",
-        "description": f"Order: {item_names}",
-        "amount": -total_cost,
-        "timestamp": ts,
-        "order_id": order_id,
-        "items": order_items,
-    }
-    db.put("transactions", db.next_id(), tx)
+    try:
+        _, new_balance = ledger.append(user["email"], {
+            "type": "SPEND",
+            "description": f"Order: {item_names}",
+            "amount": -total_cost,
+            "timestamp": ts,
+            "order_id": order_id,
+            "items": order_items,
+        }, require_funds=True)
+    except Exception as e:
+        # No sale: a cart reservation goes back to its TTL, an inline hold back to stock
+        if req.reservation_id:
+            inventory.unpin(hold["id"])
+        else:
+            inventory.release(hold["id"])
+        if isinstance(e, ledger.InsufficientBalance):
+            raise HTTPException(400, "Insufficient balance")
+        raise
+    try:
+        inventory.commit(hold["id"], user["email"])
+    except inventory.ReservationNotFound:
+        # The hold is pinned, so only a catalog reset (which rebuilds the counters) drops it
+        print(f"[inventory] Reservation {hold['id']} dropped by a reset before commit (order {order_id})")
 
-    # Recalculate green score after spending
-    _recalculate_green_score(user)
+    # Recalculate green score after the response is sent
+    background.add_task(_recalculate_green_score, user)
 
     return {
         "order_id": order_id,
@@ -691,14 +1013,15 @@ def checkout(req: CheckoutRequest, authorization: str = Header(None)):
 
 @app.get("/api/transactions")
 def get_transactions(authorization: str = Header(None)):
-    user = get_user_from_header(authorization)
+    user = get_identity(authorization)
     if not user: raise HTTPException(401, "Unauthorized")
     user_tx = db.get_transactions_by_email(user["email"])
     
     # Synthesize Welcome Bonus if missing (for older accounts)
     has_bonus = any(t.get("type") == "BONUS" for t in user_tx)
     if not has_bonus:
-        created_at = user.get("createdAt", db.now_iso())
+        profile = get_user_from_header(authorization) or {}
+        created_at = profile.get("createdAt", db.now_iso())
         user_tx.append({
             "timestamp": created_at,
             "description": "Account Created (Welcome Bonus)",
@@ -712,12 +1035,10 @@ def get_transactions(authorization: str = Header(None)):
 
 @app.get("/api/wallet")
 def get_wallet_info(authorization: str = Header(None)):
-    user = get_user_from_header(authorization)
+    user = get_identity(authorization)
     if not user: raise HTTPException(401, "Unauthorized")
     
-    wallet = db.find_one("user_wallets", "email", user["email"])
-    if not wallet: return {"balance": 0}
-    return wallet
+    return ledger.wallet(user["email"])
 
 @app.put("/api/profile")
 def update_profile(req: ProfileUpdateRequest, authorization: str = Header(None)):
@@ -783,35 +1104,33 @@ async def ai_chat(req: AiChatRequest):
         "generationConfig": {"temperature": 0.4, "maxOutputTokens": 280},
     }
 
-    preferred_models = [GEMINI_MODEL, "gemini-2.0-flash", "gemini-1.5-flash", "gemini-1.5-flash-latest"]
     tried = []
 
     try:
-        async with httpx.AsyncClient(timeout=20) as client:
-            for model in preferred_models:
-                if model in tried:
-                    continue
-                tried.append(model)
-                url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={GEMINI_API_KEY}"
-                res = await client.post(url, json=payload)
-                if res.status_code == 404:
-                    continue
-                res.raise_for_status()
-                data = res.json()
-                reply = (
-                    data.get("candidates", [{}])[0]
-                    .get("content", {})
-                    .get("parts", [{}])[0]
-                    .get("text", "")
-                    .strip()
-                )
-                if not reply:
-                    reply = "I could not generate a response right now."
-                return {"reply": reply, "source": "gemini", "model": model}
+        for model in ai.chat_models():
+            tried.append(model)
+            url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={GEMINI_API_KEY}"
+            res = await ai.http().post(url, json=payload, timeout=20)
+            if res.status_code == 404:
+                ai.remember_model(model, False)
+                continue
+            res.raise_for_status()
+            ai.remember_model(model, True)
+            data = res.json()
+            reply = (
+                data.get("candidates", [{}])[0]
+                .get("content", {})
+                .get("parts", [{}])[0]
+                .get("text", "")
+                .strip()
+            )
+            if not reply:
+                reply = "I could not generate a response right now."
+            return {"reply": reply, "source": "gemini", "model": model}
     except Exception as e:
         raise HTTPException(502, f"Gemini request failed: {str(e)}")
 
-    raise HTTPException(502, f"No compatible Gemini model found from: {', '.join(tried)}")
+    raise HTTPException(502, f"No compatible Gemini model found from: {', '.join(tried or ai.CHAT_MODELS)}")
 
 
 @app.post("/api/ai/speech-to-text")
@@ -834,13 +1153,13 @@ async def ai_speech_to_text(file: UploadFile = File(...)):
     headers = {"xi-api-key": ELEVENLABS_API_KEY}
 
     try:
-        async with httpx.AsyncClient(timeout=60) as client:
-            res = await client.post(
-                "https://api.elevenlabs.io/v1/speech-to-text",
-                headers=headers,
-                data=data,
-                files=files,
-            )
+        res = await ai.http().post(
+            "https://api.elevenlabs.io/v1/speech-to-text",
+            headers=headers,
+            data=data,
+            files=files,
+            timeout=60,
+        )
         if res.status_code >= 400:
             raise HTTPException(502, f"ElevenLabs STT failed: {res.status_code} {res.text[:240]}")
         payload = res.json()
@@ -0,0 +1,260 @@
+"""
+Warm OCR worker pool
+====================
+OCR_WORKERS long-lived processes each load `easyocr.Reader` once and then
+serve jobs, instead of a fresh subprocess (and model load) per receipt.
+
+  - jobs wait in one local queue; a supervisor thread per worker feeds its
+    process over a pipe, so a free worker always takes the next job
+  - each job has a deadline (OCR_JOB_TIMEOUT); a worker that misses it is
+    killed and respawned, and the job fails with OCRTimeout
+  - each worker is limited to OCR_THREADS_PER_WORKER torch/OpenMP threads and,
+    on Linux, pinned to its own CPU slice, so workers don't oversubscribe cores
+
+    result = await ocr_pool.ocr(image_bytes)   # same shape as ocr_service.scan
+"""
+
+import os, asyncio, multiprocessing, queue, threading, time, importlib.util
+from typing import Optional
+
+CPUS = os.cpu_count() or 1
+WORKERS = max(1, int(os.getenv("OCR_WORKERS", str(max(1, CPUS // 4)))))
+THREADS_PER_WORKER = max(1, int(os.getenv("OCR_THREADS_PER_WORKER", str(max(1, CPUS // WORKERS)))))
+JOB_TIMEOUT = float(os.getenv("OCR_JOB_TIMEOUT", "30"))
+PIN_CPUS = os.getenv("OCR_PIN_CPUS", "1") == "1" and hasattr(os, "sched_setaffinity")
+START_TIMEOUT = float(os.getenv("OCR_START_TIMEOUT", "180"))  # first model load can download weights
+
+class OCRUnavailable(Exception):
+    pass
+
+class OCRTimeout(Exception):
+    pass
+
+# ── Worker process ─────────────────────────────────────────
+
+def _worker_main(conn, threads: int, cpus: Optional[list]):
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except OSError:
+            pass
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    try:
+        import easyocr
+        from backend.receipt_image import preprocess
+        from services.ocr_service import summarize
+        reader = easyocr.Reader(["en"], gpu=False, verbose=False)
+    except Exception as e:
+        conn.send(("error", f"OCR worker failed to start: {e}"))
+        return
+    conn.send(("ready", None))
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        t0 = time.perf_counter()
+        try:
+            prepared = preprocess(job)
+            source = prepared.image if prepared.image is not None else job
+            result = summarize(reader.readtext(source, detail=1))
+            result["preprocess"] = prepared.summary()
+            result["ocrMs"] = round((time.perf_counter() - t0) * 1000, 1)
+            conn.send(("ok", result))
+        except Exception as e:
+            conn.send(("error", str(e)))
+
+# ── Supervisor (parent side) ───────────────────────────────
+
+_ctx = multiprocessing.get_context("spawn")
+_jobs: "queue.Queue" = queue.Queue()
+_workers: list = []
+_start_lock = threading.Lock()
+_stats = {"completed": 0, "failed": 0, "timeouts": 0, "restarts": 0, "busy": 0, "totalMs": 0.0}
+_stats_lock = threading.Lock()
+
+def _bump(key: str, by=1):
+    with _stats_lock:
+        _stats[key] += by
+
+class _Worker:
+    def __init__(self, index: int):
+        self.index = index
+        self.proc = None
+        self.conn = None
+        self.error = None
+        self.thread = threading.Thread(target=self._serve, daemon=True, name=f"ocr-supervisor-{index}")
+
+    def _cpus(self) -> Optional[list]:
+        if not PIN_CPUS:
+            return None
+        start = (self.index * THREADS_PER_WORKER) % CPUS
+        return sorted({(start + i) % CPUS for i in range(THREADS_PER_WORKER)})
+
+    def spawn(self) -> bool:
+        parent, child = _ctx.Pipe()
+        self.proc = _ctx.Process(target=_worker_main, args=(child, THREADS_PER_WORKER, self._cpus()),
+                                 daemon=True, name=f"ocr-worker-{self.index}")
+        try:
+            self.proc.start()
+        except Exception as e:
+            self.error = f"OCR worker could not be started: {e}"
+            self.proc = None
+            return False
+        finally:
+            child.close()
+        self.conn = parent
+        if not parent.poll(START_TIMEOUT):
+            self.error = "OCR worker did not become ready in time"
+            self.kill()
+            return False
+        status, detail = parent.recv()
+        if status != "ready":
+            self.error = detail
+            self.kill()
+            return False
+        self.error = None
+        return True
+
+    def kill(self):
+        if self.proc is not None and self.proc.is_alive():
+            self.proc.kill()
+            self.proc.join(5)
+        self.proc = None
+
+    def _serve(self):
+        # Load the model now rather than on the first job
+        if not self.spawn():
+            print(f"[ocr] Worker {self.index} failed to start: {self.error}")
+        while True:
+            job = _jobs.get()
+            if job is None:
+                self.stop()
+                return
+            data, deadline, deliver = job
+            if self.proc is None and not self.spawn():
+                deliver(OCRUnavailable(self.error))
+                _bump("failed")
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                deliver(OCRTimeout("OCR job expired in queue"))
+                _bump("timeouts")
+                continue
+            _bump("busy")
+            t0 = time.perf_counter()
+            try:
+                self.conn.send(data)
+                if not self.conn.poll(remaining):
+                    # Stuck on this job: kill it and start a fresh worker for the next one
+                    print(f"[ocr] Worker {self.index} missed a job deadline; respawning")
+                    self.kill()
+                    _bump("timeouts")
+                    _bump("restarts")
+                    deliver(OCRTimeout("OCR job timed out"))
+                    self.spawn()
+                    continue
+                status, payload = self.conn.recv()
+            except (EOFError, OSError, BrokenPipeError) as e:
+                self.kill()
+                _bump("restarts")
+                _bump("failed")
+                deliver(OCRUnavailable(f"OCR worker crashed: {e}"))
+                self.spawn()
+                continue
+            finally:
+                _bump("busy", -1)
+            if status == "ok":
+                _bump("completed")
+                _bump("totalMs", (time.perf_counter() - t0) * 1000)
+                deliver(payload)
+            else:
+                _bump("failed")
+                deliver(RuntimeError(payload))
+
+    def stop(self):
+        if self.conn is not None:
+            try:
+                self.conn.send(None)
+            except (OSError, BrokenPipeError):
+                pass
+        if self.proc is not None:
+            self.proc.join(5)
+        self.kill()
+
+# ── Public API ─────────────────────────────────────────────
+
+def available() -> bool:
+    return importlib.util.find_spec("easyocr") is not None
+
+def start():
+    """Spawn the workers (model load happens in the background)."""
+    with _start_lock:
+        if _workers:
+            return
+        if not available():
+            raise OCRUnavailable("easyocr not installed")
+        for i in range(WORKERS):
+            w = _Worker(i)
+            _workers.append(w)
+            w.thread.start()
+        print(f"[ocr] Pool started: {WORKERS} workers x {THREADS_PER_WORKER} threads")
+
+def stop():
+    with _start_lock:
+        for _ in _workers:
+            _jobs.put(None)
+        for w in _workers:
+            w.thread.join(10)
+        _workers.clear()
+
+async def ocr(image_bytes: bytes, timeout: float = None) -> dict:
+    """OCR one image on the pool; raises OCRTimeout / OCRUnavailable."""
+    if not _workers:
+        start()
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+
+    def deliver(outcome):
+        def _set():
+            if fut.done():
+                return
+            if isinstance(outcome, Exception):
+                fut.set_exception(outcome)
+            else:
+                fut.set_result(outcome)
+        loop.call_soon_threadsafe(_set)
+
+    budget = timeout or JOB_TIMEOUT
+    _jobs.put((image_bytes, time.monotonic() + budget, deliver))
+    try:
+        # Also bounds time spent queued behind workers that are still loading
+        return await asyncio.wait_for(fut, budget + 1)
+    except asyncio.TimeoutError:
+        raise OCRTimeout("OCR job timed out")
+
+def stats() -> dict:
+    with _stats_lock:
+        s = dict(_stats)
+    done = s["completed"]
+    return {
+        "workers": len(_workers),
+        "alive": sum(1 for w in _workers if w.proc is not None and w.proc.is_alive()),
+        "threadsPerWorker": THREADS_PER_WORKER,
+        "queueDepth": _jobs.qsize(),
+        "busy": s["busy"],
+        "completed": done,
+        "failed": s["failed"],
+        "timeouts": s["timeouts"],
+        "restarts": s["restarts"],
+        "avgMs": round(s["totalMs"] / done, 1) if done else None,
+    }
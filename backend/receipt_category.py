@@ -0,0 +1,238 @@
+"""
+Receipt category classifier
+===========================
+Nearest-centroid over labelled receipt texts kept in the `category_examples`
+collection ({"text", "category"}). Each category's centroid is the
+normalised sum of its examples' embeddings (backend/embeddings.py); the
+centroids are stacked into one (categories, DIMENSION) matrix, so
+classifying a batch of receipts is one `embed` call and one matrix product.
+
+Example writes only queue ids; the next classification embeds the queued
+texts in one batch and adjusts the per-category sums. An empty collection is
+seeded with SEED_EXAMPLES. Examples get dense ids from 0: the beta Cortex
+scroll only walks ids below the collection's vector count.
+
+Returns None when the embedder is unavailable (or there are no examples);
+callers keep receipt_parser's keyword match in that case.
+
+    python -m backend.receipt_category --import benchmarks/receipt_corpus.jsonl
+    python -m backend.receipt_category --eval benchmarks/receipt_corpus.jsonl
+"""
+
+import os, re, json, threading, time
+from typing import List, Optional
+
+import numpy as np
+
+from backend import db, embeddings, receipt_parser
+
+COLLECTION = "category_examples"
+CATEGORIES = [name for name, _ in receipt_parser.CATEGORIES]
+# A sure call (confidence 0.95) needs the best centroid this far ahead of the
+# runner-up and at least this similar; less of either scales confidence down
+SURE_MARGIN = float(os.getenv("CATEGORY_SURE_MARGIN", "0.25"))
+SURE_SIMILARITY = float(os.getenv("CATEGORY_SURE_SIMILARITY", "0.3"))
+RETRY_AFTER = 60  # seconds before retrying an embedder that failed
+
+SEED_EXAMPLES = [
+    ("Bart", "BART Bay Area Rapid Transit fare ticket station exit"),
+    ("Bart", "Clipper card reload BART station ticket machine receipt"),
+    ("Bart", "BART parking daily fee station total"),
+    ("Bart", "Bay Area Rapid Transit trip Embarcadero to Berkeley fare paid"),
+    ("CalTrain", "Caltrain zone fare one way ticket"),
+    ("CalTrain", "Caltrain monthly pass Clipper go pass peninsula receipt"),
+    ("CalTrain", "Caltrain ticket vending machine San Francisco 4th and King station"),
+    ("CalTrain", "Peninsula Corridor Joint Powers Board train fare total paid"),
+    ("MUNI", "SFMTA Muni fare bus metro single ride"),
+    ("MUNI", "Muni monthly pass MuniMobile ticket receipt"),
+    ("MUNI", "San Francisco Municipal Transportation Agency visitor passport"),
+    ("MUNI", "SF Muni cable car streetcar adult ride amount paid"),
+    ("Bike charging", "e-bike battery charging dock session"),
+    ("Bike charging", "bike share ebike ride unlock fee minutes ride total"),
+    ("Bike charging", "Lyft Bay Wheels ebike ride receipt"),
+    ("Bike charging", "electric bicycle charging station dock"),
+    ("EV charging", "EV charging session kWh energy delivered charger"),
+    ("EV charging", "ChargePoint station level 2 session energy fee kWh total charged"),
+    ("EV charging", "Tesla Supercharger receipt kWh invoice subtotal tax"),
+    ("EV charging", "EVgo fast charging DC session kWh"),
+    ("EV charging", "Electrify America charging session idle fee"),
+]
+
+_WORD = re.compile(r"[A-Za-z][A-Za-z-]*")
+
+_lock = threading.RLock()  # seeding writes re-enter through _on_write
+_rows: dict[int, tuple[int, np.ndarray]] = {}   # example id -> (category index, vector)
+_sums = np.zeros((len(CATEGORIES), embeddings.DIMENSION), dtype=np.float64)
+_counts = np.zeros(len(CATEGORIES), dtype=np.int64)
+_centroids = np.zeros((0, embeddings.DIMENSION), dtype=np.float32)
+_centroid_cats: List[int] = []
+_pending: dict[int, Optional[dict]] = {}
+_loaded = False
+_failed_at = 0.0
+
+def example_text(text: str) -> str:
+    """Words only: amounts, dates and receipt numbers say nothing about the category."""
+    return " ".join(_WORD.findall(text))
+
+# ── Centroids ──────────────────────────────────────────────
+
+def _apply(changes: dict[int, Optional[dict]]):
+    """Embed added/changed examples in one batch and move the category sums."""
+    global _centroids, _centroid_cats
+    fresh = [(rid, CATEGORIES.index(p["category"]), example_text(p.get("text", "")))
+             for rid, p in changes.items() if p and p.get("category") in CATEGORIES]
+    vectors = embeddings.embed([t for _, _, t in fresh])  # may raise EmbedderUnavailable
+    for rid in changes:
+        old = _rows.pop(rid, None)
+        if old is not None:
+            _sums[old[0]] -= old[1]
+            _counts[old[0]] -= 1
+    for (rid, cat, _), vec in zip(fresh, vectors):
+        _rows[rid] = (cat, vec)
+        _sums[cat] += vec
+        _counts[cat] += 1
+    _centroid_cats = [c for c in range(len(CATEGORIES)) if _counts[c] > 0]
+    if not _centroid_cats:
+        _centroids = np.zeros((0, embeddings.DIMENSION), dtype=np.float32)
+        return
+    means = embeddings.normalize_rows(_sums[_centroid_cats])
+    # Words every category shares (receipt, total, tax…) sit in the mean; taking
+    # it out leaves what tells the categories apart
+    if len(_centroid_cats) > 1:
+        means = means - means.mean(axis=0)
+    _centroids = embeddings.normalize_rows(means)
+
+def _load():
+    global _loaded
+    stored = {r["_id"]: r for r in db.scan(COLLECTION)}
+    if not stored:
+        seeds = [(COLLECTION, i, {"text": text, "category": cat})
+                 for i, (cat, text) in enumerate(SEED_EXAMPLES)]
+        db.put_many(seeds)
+        stored = {rid: p for _, rid, p in seeds}
+    _rows.clear()
+    _sums[:] = 0
+    _counts[:] = 0
+    _pending.clear()
+    _apply(stored)
+    _loaded = True
+    print(f"[category] Built {len(_centroid_cats)} centroids from {len(_rows)} examples ({embeddings.PROVIDER})")
+
+def _ensure() -> bool:
+    """Centroids are current; False if the embedder is unavailable."""
+    global _failed_at
+    if _failed_at and time.time() - _failed_at < RETRY_AFTER:
+        return False
+    try:
+        if not _loaded:
+            _load()
+        elif _pending:
+            _apply(dict(_pending))
+            _pending.clear()  # only once applied, so a failed embed is retried
+    except embeddings.EmbedderUnavailable as e:
+        print(f"[category] Embedder unavailable, using keywords: {e}")
+        _failed_at = time.time()
+        return False
+    _failed_at = 0.0
+    return len(_centroid_cats) > 0
+
+def _on_write(ids, payloads):
+    global _loaded
+    with _lock:
+        if ids is None:
+            _loaded = False  # collection reset; reloaded (and re-seeded) on next use
+            return
+        if _loaded:
+            _pending.update(zip(ids, payloads))
+
+db.on_write(COLLECTION, _on_write)
+
+# ── Public API ─────────────────────────────────────────────
+
+def classify_many(texts: List[str]) -> Optional[List[tuple[str, float]]]:
+    """(category, 0–1 confidence) per receipt text, or None if the embedder is unavailable."""
+    with _lock:
+        if not _ensure():
+            return None
+        centroids, cats = _centroids, _centroid_cats
+    if not texts:
+        return []
+    try:
+        vectors = embeddings.embed([example_text(t) for t in texts])
+    except embeddings.EmbedderUnavailable as e:
+        print(f"[category] Embedder unavailable, using keywords: {e}")
+        return None
+    scores = vectors @ centroids.T  # (texts, categories) cosine similarities
+    order = np.argsort(-scores, axis=1)
+    best = scores[np.arange(len(texts)), order[:, 0]]
+    second = scores[np.arange(len(texts)), order[:, 1]] if len(cats) > 1 else np.zeros(len(texts))
+    confidence = (np.clip((best - second) / SURE_MARGIN, 0.0, 1.0)
+                  * np.clip(best / SURE_SIMILARITY, 0.0, 1.0) * 0.95)
+    return [(CATEGORIES[cats[i]], round(float(c), 3)) for i, c in zip(order[:, 0], confidence)]
+
+def classify(text: str) -> Optional[tuple[str, float]]:
+    result = classify_many([text])
+    return result[0] if result else None
+
+def add_examples(examples: List[tuple[str, str]]) -> int:
+    """Store new (category, text) examples; returns how many were added."""
+    with _lock:
+        stored = list(db.scan(COLLECTION))
+        known = {(r.get("category"), r.get("text")) for r in stored}
+        next_id = max((r["_id"] for r in stored), default=-1) + 1
+        fresh = []
+        for cat, text in examples:
+            if cat in CATEGORIES and example_text(text) and (cat, text) not in known:
+                known.add((cat, text))
+                fresh.append({"text": text, "category": cat})
+        db.put_many([(COLLECTION, next_id + i, p) for i, p in enumerate(fresh)])
+        return len(fresh)
+
+def stats() -> dict:
+    with _lock:
+        return {
+            "loaded": _loaded,
+            "provider": embeddings.PROVIDER,
+            "examples": {CATEGORIES[c]: int(_counts[c]) for c in range(len(CATEGORIES))},
+            "pending": len(_pending),
+            "embedderDown": bool(_failed_at),
+        }
+
+def _read_labelled(path: str) -> List[tuple[str, str]]:
+    """(category, text) from {"text", "category"} or corpus-style {"lines", "expected"} rows."""
+    out = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                if "lines" in row:
+                    out.append((row["expected"]["category"], "\n".join(row["lines"])))
+                else:
+                    out.append((row["category"], row["text"]))
+    return out
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--import", dest="import_path", help="store labelled examples from a JSONL file")
+    parser.add_argument("--eval", dest="eval_path", help="accuracy against a labelled JSONL file")
+    args = parser.parse_args()
+
+    if args.import_path:
+        print(f"Stored {add_examples(_read_labelled(args.import_path))} examples")
+    if args.eval_path:
+        rows = _read_labelled(args.eval_path)
+        t0 = time.perf_counter()
+        results = classify_many([text for _, text in rows])
+        elapsed = time.perf_counter() - t0
+        if results is None:
+            raise SystemExit("Embedder unavailable")
+        keyword = [receipt_parser.parse(text.split("\n"))[0]["category"] for _, text in rows]
+        hits = sum(cat == got for (cat, _), (got, _) in zip(rows, results))
+        kw_hits = sum(cat == got for (cat, _), got in zip(rows, keyword))
+        sure = sum(conf >= 0.7 for _, conf in results)
+        print(f"centroid: {hits}/{len(rows)} ({sure} with confidence ≥ 0.7)   keywords: {kw_hits}/{len(rows)}   "
+              f"batch of {len(rows)} in {elapsed * 1000:.1f} ms (incl. first load)")
+        for (cat, text), (got, conf) in zip(rows, results):
+            if cat != got:
+                print(f"  expected {cat}, got {got} ({conf}): {text[:70]!r}")
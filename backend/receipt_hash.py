@@ -0,0 +1,246 @@
+"""
+Receipt image hashing
+=====================
+Every analysed receipt gets a 64-bit difference hash (dHash) of its
+preprocessed image (grayscale, upright, cropped to the paper — see
+backend/receipt_image.py), so a re-photographed receipt lands within a few
+bits of the original even when OCR reads its number differently.
+
+Hashes of past claims live in a multi-index hash table: the 64 bits are
+split into three chunks with one table per chunk. Two hashes within
+Hamming distance r agree to within r // 3 bits on at least one chunk, so a
+radius query probes each table with every chunk value that close to its
+own (~720 probes in total at the default radius of 8) and verifies the
+candidates with a popcount. Query cost depends on bucket sizes, not on how
+many receipts are indexed: ~0.4 ms at a million hashes. Each extra bit of
+radius past a multiple of 3 multiplies the probes by roughly 7.
+
+A dHash sees layout, not digits: two different receipts from the same
+ticket machine can be as close as a re-photo of one. A near hash therefore
+only counts as a duplicate when amount and date match too.
+
+Every analysis is stored in the `receipt_analyses` collection (email,
+hash, amount, date) and the client only gets its id back. /api/claims
+requires that id and takes the hash from the stored analysis, so the check
+can't be skipped or fed another image's hash, and it holds across API
+workers. An analysis is good for one claim within RECEIPT_HASH_RECENT_HOURS.
+"""
+
+import os, threading, time
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image
+
+from backend import db
+
+RADIUS = int(os.getenv("RECEIPT_HASH_RADIUS", "8"))
+ANALYSIS_TTL = float(os.getenv("RECEIPT_HASH_RECENT_HOURS", "24")) * 3600
+ANALYSES = "receipt_analyses"
+# (shift, width) of each chunk: 22+21+21 bits. Chunks about log2(receipts)
+# wide keep buckets small at millions of entries.
+CHUNKS = [(0, 22), (22, 21), (43, 21)]
+
+# ── Hashing ────────────────────────────────────────────────
+
+def dhash(gray: np.ndarray) -> int:
+    """64-bit difference hash: sign of horizontal gradients on a 9x8 thumbnail."""
+    small = np.asarray(Image.fromarray(gray).resize((9, 8), Image.Resampling.BOX), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def to_hex(h: int) -> str:
+    return f"{h:016x}"
+
+def from_hex(s: Optional[str]) -> Optional[int]:
+    try:
+        h = int(s, 16)
+    except (TypeError, ValueError):
+        return None
+    return h if 0 <= h < 1 << 64 else None
+
+# ── Multi-index hash table ─────────────────────────────────
+
+_masks_cache: dict[tuple[int, int], List[int]] = {}
+
+def _chunk_masks(width: int, radius: int) -> List[int]:
+    """Every `width`-bit XOR mask with at most `radius` bits set."""
+    key = (width, radius)
+    if key not in _masks_cache:
+        masks = [0]
+        for _ in range(radius):
+            masks = sorted({m | (1 << b) for m in masks for b in range(width)} | set(masks))
+        _masks_cache[key] = masks
+    return _masks_cache[key]
+
+def _chunks(h: int) -> List[int]:
+    return [(h >> shift) & ((1 << width) - 1) for shift, width in CHUNKS]
+
+class HashIndex:
+    def __init__(self):
+        self.tables: List[dict[int, set]] = [{} for _ in CHUNKS]
+        self.entries: dict[int, dict[int, tuple]] = {}  # hash -> {record_id: info}
+
+    def __len__(self):
+        return sum(len(v) for v in self.entries.values())
+
+    def add(self, h: int, record_id: int, info: tuple = ()):
+        records = self.entries.get(h)
+        if records is None:
+            records = self.entries[h] = {}
+            for table, chunk in zip(self.tables, _chunks(h)):
+                table.setdefault(chunk, set()).add(h)
+        records[record_id] = info
+
+    def remove(self, h: int, record_id: int):
+        records = self.entries.get(h)
+        if records is None:
+            return
+        records.pop(record_id, None)
+        if records:
+            return
+        del self.entries[h]
+        for table, chunk in zip(self.tables, _chunks(h)):
+            bucket = table.get(chunk)
+            if bucket:
+                bucket.discard(h)
+                if not bucket:
+                    del table[chunk]
+
+    def query(self, h: int, radius: int = RADIUS) -> List[tuple[int, int, tuple]]:
+        """(distance, record_id, info) for every entry within `radius` bits, nearest first."""
+        sub_radius = radius // len(CHUNKS)
+        candidates = set()
+        for table, chunk, (_, width) in zip(self.tables, _chunks(h), CHUNKS):
+            # Probe every chunk value within sub_radius (map/filter keep the loop in C)
+            buckets = filter(None, map(table.get, map(chunk.__xor__, _chunk_masks(width, sub_radius))))
+            candidates.update(*buckets)
+        hits = []
+        for candidate in candidates:
+            d = (candidate ^ h).bit_count()
+            if d <= radius:
+                hits.extend((d, rid, info) for rid, info in self.entries[candidate].items())
+        hits.sort(key=lambda x: (x[0], x[1]))
+        return hits
+
+# ── Claims index ───────────────────────────────────────────
+
+_index = HashIndex()
+_hash_by_claim: dict[int, int] = {}
+_lock = threading.Lock()
+_ready = False
+
+def _info(claim: dict) -> tuple:
+    return round(float(claim.get("amount") or 0), 2), str(claim.get("date") or "")
+
+def _add_claim(claim_id: int, claim: dict):
+    old = _hash_by_claim.pop(claim_id, None)
+    if old is not None:
+        _index.remove(old, claim_id)
+    h = from_hex(claim.get("imageHash")) if claim else None
+    if h is not None:
+        _index.add(h, claim_id, _info(claim))
+        _hash_by_claim[claim_id] = h
+
+def rebuild():
+    global _index, _ready
+    started = time.time()
+    claims = [(c["_id"], c) for c in db.scan("claims") if c.get("imageHash")]
+    with _lock:
+        _index = HashIndex()
+        _hash_by_claim.clear()
+        for claim_id, claim in claims:
+            _add_claim(claim_id, claim)
+        _ready = True
+    print(f"[receipt-hash] Indexed {len(_hash_by_claim)} receipt images in {time.time() - started:.2f}s")
+
+def _ensure():
+    if not _ready:
+        rebuild()
+
+def _on_write(ids, payloads):
+    global _ready
+    with _lock:
+        if ids is None:
+            _ready = False  # collection reset; rebuilt on next use
+            return
+        if not _ready:
+            return
+        for claim_id, payload in zip(ids, payloads):
+            _add_claim(claim_id, payload)
+
+db.on_write("claims", _on_write)
+
+def _matches(h: int, amount: float, date: str, radius: int) -> List[dict]:
+    want = (round(float(amount or 0), 2), str(date or ""))
+    return [{"claimId": rid, "distance": d} for d, rid, info in _index.query(h, radius) if info == want]
+
+def find_duplicates(h: int, amount: float, date: str, radius: int = RADIUS) -> List[dict]:
+    """Past claims whose image is within `radius` bits and whose amount and date match."""
+    _ensure()
+    with _lock:
+        return _matches(h, amount, date, radius)
+
+def check_and_add(h: int, claim_id: int, amount: float, date: str, radius: int = RADIUS) -> List[dict]:
+    """find_duplicates + index the new claim atomically, so two concurrent
+    submissions of the same photo can't both pass."""
+    _ensure()
+    with _lock:
+        matches = _matches(h, amount, date, radius)
+        _index.add(h, claim_id, (round(float(amount or 0), 2), str(date or "")))
+        _hash_by_claim[claim_id] = h
+        return matches
+
+def discard(claim_id: int):
+    """Undo check_and_add for a claim that was never stored."""
+    with _lock:
+        _add_claim(claim_id, None)
+
+# ── Stored analyses ────────────────────────────────────────
+
+_analyses_lock = threading.Lock()
+
+def record_analysis(email: str, h: Optional[int], amount, date) -> int:
+    """Store what the server saw in a receipt image; returns the analysis id."""
+    analysis_id = db.next_id()
+    db.put(ANALYSES, analysis_id, {
+        "email": email,
+        "imageHash": to_hex(h) if h is not None else None,
+        "amount": amount,
+        "date": date,
+        "issuedAt": time.time(),
+        "claimId": None,
+    })
+    return analysis_id
+
+def use_analysis(analysis_id: int, email: str, claim_id: int) -> Optional[dict]:
+    """Bind `email`'s unexpired, unused analysis to `claim_id`; None if there is no such analysis."""
+    with _analyses_lock:
+        analysis = db.get_by_id(ANALYSES, analysis_id)
+        if (not analysis or analysis.get("email") != email or analysis.get("claimId") is not None
+                or time.time() - float(analysis.get("issuedAt") or 0) > ANALYSIS_TTL):
+            return None
+        analysis = {k: v for k, v in analysis.items() if k != "_id"}
+        analysis["claimId"] = claim_id
+        db.put(ANALYSES, analysis_id, analysis)
+        return analysis
+
+def release_analysis(analysis_id: int, claim_id: int):
+    """Make an analysis usable again after its claim failed to save."""
+    with _analyses_lock:
+        analysis = db.get_by_id(ANALYSES, analysis_id)
+        if analysis and analysis.get("claimId") == claim_id:
+            analysis = {k: v for k, v in analysis.items() if k != "_id"}
+            analysis["claimId"] = None
+            db.put(ANALYSES, analysis_id, analysis)
+
+def stats() -> dict:
+    with _lock:
+        buckets = [len(b) for t in _index.tables for b in t.values()]
+        return {
+            "ready": _ready,
+            "receipts": len(_hash_by_claim),
+            "distinctHashes": len(_index.entries),
+            "radius": RADIUS,
+            "maxBucket": max(buckets, default=0),
+        }
@@ -0,0 +1,246 @@
+"""
+Personalised reward recommendations
+===================================
+A batch job builds one taste vector per user: the recency-decayed mean of
+the embeddings of items they spent points on plus the categories they
+claimed for. Vectors live in the Actian `user_taste` collection (an
+in-process dict without Actian).
+
+Serving a recommendation is one taste read and one k-NN search over the
+item index (backend/search.py). Results are cached per user and reused
+until the user's ledger head moves, i.e. until their next transaction.
+A spend or claim also marks the user's taste stale: their next request
+rebuilds it (and the seen set) from their own history instead of waiting
+for the batch job.
+
+The batch job scans every user, transaction and claim, so it runs from the
+CLI (cron) by default; RECOMMEND_REBUILD_MINUTES > 0 also runs it inside
+the API process.
+
+    python -m backend.recommend      # rebuild every user's taste vector
+"""
+
+import os, math, threading, time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timezone
+from typing import Optional, List
+
+import numpy as np
+
+from backend import db, catalog, embeddings, ledger, search
+from services import actian_service
+
+HALF_LIFE_DAYS = float(os.getenv("TASTE_HALF_LIFE_DAYS", "30"))
+CLAIM_WEIGHT = float(os.getenv("TASTE_CLAIM_WEIGHT", "0.5"))
+CACHE_SIZE = int(os.getenv("RECOMMEND_CACHE_SIZE", "10000"))
+REBUILD_MINUTES = float(os.getenv("RECOMMEND_REBUILD_MINUTES", "0"))
+BATCH = 256
+
+_tastes: dict[int, dict] = {}  # uid -> {"vector", "payload"} (no Actian)
+_recs: "OrderedDict[int, tuple[int, int, dict]]" = OrderedDict()
+_recs_lock = threading.Lock()
+_stale: set[str] = set()  # emails whose spends/claims postdate their stored taste
+
+# ── Taste vectors ──────────────────────────────────────────
+
+def _weight(ts: Optional[str], now: datetime) -> float:
+    if not ts:
+        return 1.0
+    try:
+        t = datetime.fromisoformat(ts)
+    except ValueError:
+        return 1.0
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)  # db.now_iso() writes naive UTC
+    age_days = max((now - t).total_seconds() / 86400, 0.0)
+    return math.pow(0.5, age_days / HALF_LIFE_DAYS)
+
+def _spent_items(tx: dict, by_title: dict[str, int]) -> List[tuple[int, int]]:
+    """(item id, quantity) pairs a SPEND transaction paid for."""
+    if tx.get("item_id") is not None:
+        return [(int(tx["item_id"]), 1)]
+    out = []
+    for line in tx.get("items") or []:
+        rid = line.get("id", by_title.get(line.get("title")))
+        if rid is not None:
+            out.append((int(rid), int(line.get("quantity", 1))))
+    desc = tx.get("description", "")
+    if not out and desc.startswith("Redeemed: "):
+        rid = by_title.get(desc[len("Redeemed: "):])
+        if rid is not None:
+            out.append((rid, 1))
+    return out
+
+def build_tastes(histories: dict[str, tuple[List[dict], List[dict]]]) -> dict[str, dict]:
+    """email -> {"vector", "seen"} from each user's (transactions, claims)."""
+    snap = catalog.snapshot()
+    by_title = {i.get("title"): rid for rid, i in snap.by_id.items()}
+    now = datetime.now(timezone.utc)
+
+    signals: dict[str, list] = {}
+    item_ids, categories = set(), set()
+    for email, (txs, claims) in histories.items():
+        sig = []
+        for tx in txs:
+            if tx.get("type") != "SPEND":
+                continue
+            w = _weight(tx.get("timestamp"), now)
+            for rid, qty in _spent_items(tx, by_title):
+                if rid in snap.by_id:
+                    sig.append(("item", rid, w * qty))
+                    item_ids.add(rid)
+        for claim in claims:
+            if claim.get("category"):
+                sig.append(("category", claim["category"], CLAIM_WEIGHT * _weight(claim.get("timestamp"), now)))
+                categories.add(claim["category"])
+        if sig:
+            signals[email] = sig
+
+    # One embedding batch for every item and category involved
+    item_ids, categories = sorted(item_ids), sorted(categories)
+    vecs = embeddings.embed([embeddings.item_text(snap.by_id[i]) for i in item_ids] + categories)
+    lookup = {("item", rid): vecs[n] for n, rid in enumerate(item_ids)}
+    lookup.update({("category", c): vecs[len(item_ids) + n] for n, c in enumerate(categories)})
+
+    out = {}
+    for email, sig in signals.items():
+        acc = np.zeros(embeddings.DIMENSION, dtype=np.float32)
+        for kind, key, w in sig:
+            acc += w * lookup[(kind, key)]
+        norm = float(np.linalg.norm(acc))
+        if norm == 0:
+            continue
+        out[email] = {
+            "vector": acc / norm,
+            "seen": sorted({key for kind, key, _ in sig if kind == "item"}),
+        }
+    return out
+
+def _store(rows: List[tuple[int, str, dict]]):
+    """Persist (uid, email, taste) rows."""
+    stamp = db.now_iso()
+    records = [(uid, {"email": email, "seen": t["seen"], "updatedAt": stamp}, t["vector"])
+               for uid, email, t in rows]
+    if search.USE_CORTEX:
+        for start in range(0, len(records), BATCH):
+            chunk = records[start:start + BATCH]
+            actian_service.upsert_tastes({
+                "ids": [uid for uid, _, _ in chunk],
+                "vectors": [vec.tolist() for _, _, vec in chunk],
+                "payloads": [payload for _, payload, _ in chunk],
+            })
+    else:
+        for uid, payload, vec in records:
+            _tastes[uid] = {"vector": vec, "payload": payload}
+
+def _forget(uids: List[int]):
+    """Drop stored tastes of users whose history no longer yields one."""
+    if not uids:
+        return
+    if search.USE_CORTEX:
+        for start in range(0, len(uids), BATCH):
+            actian_service.delete_tastes({"ids": uids[start:start + BATCH]})
+    else:
+        for uid in uids:
+            _tastes.pop(uid, None)
+
+def _load(uid: int) -> Optional[dict]:
+    if search.USE_CORTEX:
+        row = actian_service.get_taste({"id": uid})
+        return {"vector": np.asarray(row["vector"], dtype=np.float32), "payload": row["payload"] or {}} if row else None
+    return _tastes.get(uid)
+
+def rebuild_all() -> int:
+    """Batch job: rebuild every user's taste vector from full scans."""
+    t0 = datetime.now()
+    with _recs_lock:
+        _stale.clear()  # anything written from here on is marked again
+    users = {u["email"]: u["_id"] for u in db.scan("verified_users") if u.get("email")}
+    histories: dict[str, tuple[list, list]] = defaultdict(lambda: ([], []))
+    for tx in db.scan("transactions"):
+        if tx.get("email") in users:
+            histories[tx["email"]][0].append(tx)
+    for claim in db.scan("claims"):
+        if claim.get("email") in users:
+            histories[claim["email"]][1].append(claim)
+
+    tastes = build_tastes(histories)
+    _store([(users[email], email, t) for email, t in tastes.items()])
+    _forget([uid for email, uid in users.items() if email not in tastes])
+    with _recs_lock:
+        _recs.clear()
+    print(f"[recommend] Built {len(tastes)} taste vectors for {len(users)} users "
+          f"in {(datetime.now() - t0).total_seconds():.1f}s")
+    return len(tastes)
+
+def run_periodically():
+    """Background loop for the API process, off unless RECOMMEND_REBUILD_MINUTES > 0."""
+    while REBUILD_MINUTES > 0:
+        try:
+            rebuild_all()
+        except Exception as e:
+            print(f"[recommend] Rebuild failed: {e}")
+        time.sleep(REBUILD_MINUTES * 60)
+
+def _build_one(uid: int, email: str) -> Optional[dict]:
+    """A user the batch job hasn't covered yet, or whose taste went stale."""
+    txs = db.get_transactions_by_email(email)
+    claims = db.find_by("claims", "email", email)
+    taste = build_tastes({email: (txs, claims)}).get(email)
+    if not taste:
+        _forget([uid])
+        return None
+    _store([(uid, email, taste)])
+    return {"vector": taste["vector"], "payload": {"seen": taste["seen"]}}
+
+def _mark_stale(emails):
+    with _recs_lock:
+        _stale.update(e for e in emails if e)
+
+def _on_transaction(ids, payloads):
+    if ids is not None:
+        _mark_stale(p.get("email") for p in payloads if p and p.get("type") == "SPEND")
+
+def _on_claim(ids, payloads):
+    if ids is not None:
+        _mark_stale(p.get("email") for p in payloads if p and p.get("category"))
+
+db.on_write("transactions", _on_transaction)
+db.on_write("claims", _on_claim)
+
+# ── Serving ────────────────────────────────────────────────
+
+def recommend(identity: dict, limit: int = 10) -> dict:
+    uid, email = identity["_id"], identity["email"]
+    head = ledger.wallet(email)["seq"]
+    with _recs_lock:
+        stale = email in _stale
+        hit = _recs.get(uid)
+        if hit and hit[0] == head and hit[1] == limit and not stale:
+            _recs.move_to_end(uid)
+            return hit[2]
+
+    if stale:
+        taste = _build_one(uid, email)
+        with _recs_lock:
+            _stale.discard(email)
+    else:
+        taste = _load(uid) or _build_one(uid, email)
+    if taste:
+        seen = set(taste["payload"].get("seen", []))
+        hits = search.knn(taste["vector"], {"active": True}, limit + len(seen))
+        items = search.hydrate([h for h in hits if h[0] not in seen][:limit])
+        result = {"personalized": True, "items": items}
+    else:
+        # No spending or claims yet: cheapest active rewards
+        items = [i for i in catalog.snapshot().view(None, "cost_asc") if i.get("active", True)][:limit]
+        result = {"personalized": False, "items": items}
+
+    with _recs_lock:
+        _recs[uid] = (head, limit, result)
+        if len(_recs) > CACHE_SIZE:
+            _recs.popitem(last=False)
+    return result
+
+if __name__ == "__main__":
+    rebuild_all()
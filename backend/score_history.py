@@ -0,0 +1,239 @@
+"""
+Green Score History – compacted time-series store
+==================================================
+One series per user, persisted as a single record in `score_series`.
+Each series has three tiers:
+  raw    – every recorded score, kept for SCORE_RAW_RETENTION_HOURS
+  hourly – min/max/sum/count/last per hour, kept for SCORE_HOURLY_RETENTION_DAYS
+  daily  – same aggregates per day, kept for SCORE_DAILY_RETENTION_DAYS
+Points roll raw → hourly → daily as they age, so a series stays bounded
+(a few thousand points) no matter how often the score is read.
+
+Appends only touch the in-process series; a background thread writes the
+series that changed every SCORE_FLUSH_SECONDS (and on shutdown), so a
+reading costs no DB write. Each user's series has its own striped lock.
+"""
+
+import os, threading, time
+from datetime import datetime, timezone
+from typing import Optional
+
+from backend import db
+
+COLLECTION = "score_series"
+HOUR = 3600
+DAY = 86400
+
+RAW_RETENTION = int(float(os.getenv("SCORE_RAW_RETENTION_HOURS", "48")) * HOUR)
+HOURLY_RETENTION = int(float(os.getenv("SCORE_HOURLY_RETENTION_DAYS", "90")) * DAY)
+DAILY_RETENTION = int(float(os.getenv("SCORE_DAILY_RETENTION_DAYS", "730")) * DAY)
+RAW_MAX_POINTS = int(os.getenv("SCORE_RAW_MAX_POINTS", "2000"))
+FLUSH_INTERVAL = float(os.getenv("SCORE_FLUSH_SECONDS", "30"))
+
+_series: dict[str, dict] = {}
+_dirty: set[str] = set()        # emails whose series changed since the last flush
+_series_lock = threading.Lock()  # guards _series and _dirty only, never held across I/O
+# Striped locks: one user's load/backfill/append never blocks other users
+_stripes = [threading.Lock() for _ in range(64)]
+_flusher: Optional[threading.Thread] = None
+
+def _lock_for(email: str) -> threading.Lock:
+    return _stripes[db.stable_id(email) % len(_stripes)]
+
+# ── Series layout ──────────────────────────────────────────
+# raw:    [[ts, score], ...]
+# hourly: [[bucket_ts, min, max, sum, count, last], ...]
+# daily:  [[bucket_ts, min, max, sum, count, last], ...]
+
+def reset_cache():
+    with _series_lock:
+        _series.clear()
+        _dirty.clear()
+
+def _empty(email: str) -> dict:
+    return {"email": email, "raw": [], "hourly": [], "daily": []}
+
+def _to_epoch(ts: str) -> Optional[int]:
+    try:
+        return int(datetime.fromisoformat(ts).replace(tzinfo=timezone.utc).timestamp())
+    except Exception:
+        return None
+
+def _merge_bucket(tier: list, bucket_ts: int, mn: float, mx: float, total: float, count: int, last: float):
+    # Tiers are append-mostly and sorted, so the target bucket is almost always the tail
+    if tier and tier[-1][0] == bucket_ts:
+        b = tier[-1]
+        b[1] = min(b[1], mn); b[2] = max(b[2], mx); b[3] += total; b[4] += count; b[5] = last
+        return
+    for b in reversed(tier):
+        if b[0] == bucket_ts:
+            b[1] = min(b[1], mn); b[2] = max(b[2], mx); b[3] += total; b[4] += count
+            return
+        if b[0] < bucket_ts:
+            break
+    tier.append([bucket_ts, mn, mx, total, count, last])
+    tier.sort(key=lambda b: b[0])
+
+def _compact(series: dict, now: int):
+    raw = series["raw"]
+    cut = now - RAW_RETENTION
+    spill = len(raw) - RAW_MAX_POINTS
+    keep_from = 0
+    for i, (ts, score) in enumerate(raw):
+        if ts >= cut and i >= spill:
+            break
+        _merge_bucket(series["hourly"], ts - ts % HOUR, score, score, score, 1, score)
+        keep_from = i + 1
+    if keep_from:
+        del raw[:keep_from]
+
+    hourly = series["hourly"]
+    cut = now - HOURLY_RETENTION
+    keep_from = 0
+    for i, b in enumerate(hourly):
+        if b[0] >= cut:
+            break
+        _merge_bucket(series["daily"], b[0] - b[0] % DAY, b[1], b[2], b[3], b[4], b[5])
+        keep_from = i + 1
+    if keep_from:
+        del hourly[:keep_from]
+
+    cut = now - DAILY_RETENTION
+    series["daily"] = [b for b in series["daily"] if b[0] >= cut]
+
+def _backfill(series: dict):
+    """Fold legacy one-row-per-read `green_scores` history into a new series."""
+    rows = db.find_by("green_scores", "email", series["email"], limit=100000)
+    points = sorted(
+        (ts, float(r.get("score", 0))) for r in rows
+        if (ts := _to_epoch(r.get("timestamp", ""))) is not None
+    )
+    series["raw"].extend([ts, score] for ts, score in points)
+    if points:
+        print(f"[scores] Backfilled {len(points)} legacy points for {series['email']}")
+
+def _load(email: str) -> dict:
+    """Caller holds _lock_for(email)."""
+    with _series_lock:
+        series = _series.get(email)
+    if series is not None:
+        return series
+    record = db.get_by_id(COLLECTION, db.stable_id(email))
+    if record:
+        series = {k: record.get(k, []) for k in ("raw", "hourly", "daily")}
+        series["email"] = email
+    else:
+        series = _empty(email)
+        _backfill(series)
+    with _series_lock:
+        _series[email] = series
+    return series
+
+# ── Public API ─────────────────────────────────────────────
+
+def append(email: str, score: float, ts: Optional[int] = None) -> dict:
+    """Record a score reading and compact the user's series."""
+    now = int(time.time())
+    ts = int(ts if ts is not None else now)
+    with _lock_for(email):
+        series = _load(email)
+        raw = series["raw"]
+        raw.append([ts, float(score)])
+        if len(raw) > 1 and raw[-2][0] > ts:
+            raw.sort(key=lambda p: p[0])
+        _compact(series, now)
+    with _series_lock:
+        _dirty.add(email)
+    _ensure_flusher()
+    return series
+
+def flush() -> int:
+    """Write every series changed since the last flush, in one batch."""
+    with _series_lock:
+        emails = list(_dirty)
+        _dirty.clear()
+    writes = []
+    for email in emails:
+        with _lock_for(email):
+            with _series_lock:
+                series = _series.get(email)
+            if series is not None:
+                copy = {k: [list(p) for p in series[k]] for k in ("raw", "hourly", "daily")}
+                writes.append((COLLECTION, db.stable_id(email), {"email": email, **copy}))
+    try:
+        db.put_many(writes)
+    except Exception as e:
+        print(f"[scores] Flush failed, will retry: {e}")
+        with _series_lock:
+            _dirty.update(emails)
+        return 0
+    return len(writes)
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush()
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is None:
+        with _series_lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_loop, daemon=True, name="score-flush")
+                _flusher.start()
+
+def latest(email: str) -> Optional[float]:
+    with _lock_for(email):
+        series = _load(email)
+        for tier, idx in (("raw", 1), ("hourly", 5), ("daily", 5)):
+            if series[tier]:
+                return series[tier][-1][idx]
+    return None
+
+def query(email: str, start: int, end: int, max_points: int = 400) -> dict:
+    """Range query over all tiers, re-bucketed so at most `max_points` come back.
+
+    The bucket width is the coarsest tier resolution overlapping the range, or
+    wider if needed to honour `max_points`.
+    """
+    now = int(time.time())
+    max_points = max(1, max_points)
+    if start >= now - RAW_RETENTION:
+        step = 1
+    elif start >= now - HOURLY_RETENTION:
+        step = HOUR
+    else:
+        step = DAY
+    span = max(1, end - start)
+    step = max(step, -(-span // max_points))
+
+    buckets: dict[int, list] = {}
+    def fold(ts, mn, mx, total, count):
+        if ts < start or ts > end:
+            return
+        key = start + (ts - start) // step * step
+        b = buckets.get(key)
+        if b is None:
+            buckets[key] = [mn, mx, total, count]
+        else:
+            b[0] = min(b[0], mn); b[1] = max(b[1], mx); b[2] += total; b[3] += count
+
+    with _lock_for(email):
+        series = _load(email)
+        for b in series["daily"]:
+            fold(b[0], b[1], b[2], b[3], b[4])
+        for b in series["hourly"]:
+            fold(b[0], b[1], b[2], b[3], b[4])
+        for ts, score in series["raw"]:
+            fold(ts, score, score, score, 1)
+
+    points = [
+        {
+            "t": datetime.utcfromtimestamp(key).isoformat(),
+            "score": round(b[2] / b[3], 1),
+            "min": b[0],
+            "max": b[1],
+        }
+        for key, b in sorted(buckets.items())
+    ]
+    return {"resolution": step, "points": points}
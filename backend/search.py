@@ -0,0 +1,169 @@
+"""
+Semantic marketplace search
+===========================
+Item embeddings (backend/embeddings.py) are kept in the Actian
+`marketplace_vectors` collection via services/actian_service.py, with
+type/cost/active in the payload so k-NN is filtered server-side.
+Without Actian the same vectors live in an in-process NumPy matrix and
+search is a brute-force dot product.
+
+The index follows the catalog lazily: marketplace writes only mark ids
+dirty, and the next search embeds and upserts them in one batch.
+Hits are hydrated from the catalog snapshot in a single pass.
+"""
+
+import threading
+from typing import Optional, List
+
+import numpy as np
+
+from backend import db, catalog, embeddings
+from services import actian_service
+
+USE_CORTEX = db._USE_ACTIAN and actian_service.HAS_CORTEX
+
+_lock = threading.Lock()
+_dirty: set[int] = set()
+_full_rebuild = True
+_ready = False  # Cortex collection created
+
+# Local index (no Actian)
+_ids = np.zeros(0, dtype=np.int64)
+_vectors = np.zeros((0, embeddings.DIMENSION), dtype=np.float32)
+_meta: dict[int, dict] = {}
+_texts: dict[int, str] = {}  # embedded text per item, to skip stock-only writes
+
+def _index_payload(item: dict) -> dict:
+    return {
+        "type": item.get("type"),
+        "cost": item.get("cost", 0),
+        "active": bool(item.get("active", True)),
+    }
+
+# ── Index maintenance ──────────────────────────────────────
+
+def _sync():
+    """Embed and index every item written since the last search."""
+    global _full_rebuild, _ready, _ids, _vectors
+    with _lock:
+        snap = catalog.snapshot()
+        if _full_rebuild:
+            ids = set(snap.by_id)
+            stale = set(_meta) - ids
+        else:
+            ids = {i for i in _dirty if i in snap.by_id}
+            stale = {i for i in _dirty if i not in snap.by_id}
+        if not ids and not stale:
+            return
+        items = [snap.by_id[i] for i in sorted(ids)]
+        texts = [embeddings.item_text(i) for i in items]
+        vectors = embeddings.embed(texts)
+        _texts.update({i["_id"]: t for i, t in zip(items, texts)})
+
+        if USE_CORTEX:
+            if not _ready:
+                actian_service.setup()
+                _ready = True
+            if items:
+                actian_service.batch_upsert_products({
+                    "ids": [i["_id"] for i in items],
+                    "vectors": vectors.tolist(),
+                    "payloads": [_index_payload(i) for i in items],
+                })
+            if stale:
+                actian_service.delete_products({"ids": sorted(stale)})
+            for i in items:
+                _meta[i["_id"]] = _index_payload(i)
+            for i in stale:
+                _meta.pop(i, None)
+                _texts.pop(i, None)
+        else:
+            rows = {int(rid): vec for rid, vec in zip(_ids, _vectors)}
+            for i in stale:
+                rows.pop(i, None)
+                _meta.pop(i, None)
+                _texts.pop(i, None)
+            for item, vec in zip(items, vectors):
+                rows[item["_id"]] = vec
+                _meta[item["_id"]] = _index_payload(item)
+            order = sorted(rows)
+            _ids = np.asarray(order, dtype=np.int64)
+            _vectors = (np.stack([rows[i] for i in order]) if order
+                        else np.zeros((0, embeddings.DIMENSION), dtype=np.float32))
+
+        print(f"[search] Indexed {len(items)} items, removed {len(stale)}")
+        _dirty.clear()
+        _full_rebuild = False
+
+def _on_write(ids, payloads):
+    global _full_rebuild
+    with _lock:
+        if ids is None:
+            _full_rebuild = True
+        else:
+            _dirty.update(rid for rid, p in zip(ids, payloads)
+                          if p is None or _texts.get(rid) != embeddings.item_text(p)
+                          or _meta.get(rid) != _index_payload(p))
+
+db.on_write(catalog.COLLECTION, _on_write)
+
+# ── Search ─────────────────────────────────────────────────
+
+def _filter(type: Optional[str], max_cost: Optional[float], active: Optional[bool]) -> dict:
+    flt = {}
+    if type:
+        flt["type"] = type
+    if max_cost is not None:
+        flt["cost"] = {"$lte": max_cost}
+    if active is not None:
+        flt["active"] = active
+    return flt
+
+def _matches(meta: dict, flt: dict) -> bool:
+    for field, cond in flt.items():
+        if isinstance(cond, dict):
+            if meta.get(field) is None or meta[field] > cond["$lte"]:
+                return False
+        elif meta.get(field) != cond:
+            return False
+    return True
+
+def _local_knn(vec: np.ndarray, flt: dict, limit: int) -> List[tuple[int, float]]:
+    if not len(_ids):
+        return []
+    mask = np.fromiter((_matches(_meta[int(i)], flt) for i in _ids), dtype=bool, count=len(_ids))
+    cand = np.flatnonzero(mask)
+    if not len(cand):
+        return []
+    scores = _vectors[cand] @ vec
+    k = min(limit, len(cand))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(int(_ids[cand[j]]), float(scores[j])) for j in top]
+
+def knn(vec: np.ndarray, flt: dict, limit: int) -> List[tuple[int, float]]:
+    """(item id, score) pairs nearest to `vec`, best first."""
+    _sync()
+    if USE_CORTEX:
+        hits = actian_service.search_marketplace({"vector": vec.tolist(), "limit": limit, "filter": flt})
+        return [(int(h["id"]), float(h["score"])) for h in hits]
+    return _local_knn(vec, flt, limit)
+
+def hydrate(hits: List[tuple[int, float]]) -> List[dict]:
+    by_id = catalog.snapshot().by_id
+    return [{**by_id[rid], "score": round(score, 4)} for rid, score in hits if rid in by_id]
+
+def search(q: str, type: Optional[str] = None, max_cost: Optional[float] = None,
+           active: Optional[bool] = True, limit: int = 10) -> List[dict]:
+    """Items most similar to `q`, best first, each with a `score`."""
+    vec = embeddings.embed_query(q)
+    return hydrate(knn(vec, _filter(type, max_cost, active), limit))
+
+def stats() -> dict:
+    return {
+        "backend": "cortex" if USE_CORTEX else "local",
+        "provider": embeddings.PROVIDER,
+        "indexed": len(_meta),
+        "pending": len(_dirty),
+        "queryCache": embeddings.query_cache_info(),
+    }
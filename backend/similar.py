@@ -0,0 +1,166 @@
+"""
+Similar rewards – precomputed item-to-item kNN graph
+====================================================
+Every marketplace item's top-K neighbours by embedding cosine similarity,
+computed with blocked NumPy matrix products over the whole catalog and
+stored per item in the `item_neighbors` collection. Item views read the
+in-process adjacency dict: one lookup, no vector search.
+
+Marketplace writes mark items dirty. The next lookup re-embeds only those
+items, scores them against the catalog in one product, and patches their
+own lists plus any list they enter or drop out of.
+
+    python -m backend.similar        # rebuild the whole graph
+"""
+
+import os, threading
+from typing import List
+
+import numpy as np
+
+from backend import db, catalog, embeddings
+
+COLLECTION = "item_neighbors"
+K = int(os.getenv("SIMILAR_K", "10"))
+BLOCK = int(os.getenv("SIMILAR_BLOCK", "1024"))  # rows per matrix product
+
+_lock = threading.Lock()
+_graph: dict[int, List[tuple[int, float]]] = {}
+_ids = np.zeros(0, dtype=np.int64)
+_vectors = np.zeros((0, embeddings.DIMENSION), dtype=np.float32)
+_texts: dict[int, str] = {}
+_dirty: set[int] = set()
+_loaded = False
+
+def _top_k(scores: np.ndarray, row_ids: np.ndarray, self_id: int) -> List[tuple[int, float]]:
+    k = min(K + 1, len(scores))
+    if k == 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(int(row_ids[j]), round(float(scores[j]), 4)) for j in top if row_ids[j] != self_id][:K]
+
+def _save(item_ids):
+    db.put_many([(COLLECTION, rid, {
+        "neighbors": [[n, s] for n, s in _graph.get(rid, [])],
+        "provider": embeddings.PROVIDER,
+    }) for rid in item_ids])
+
+def _embed_catalog():
+    global _ids, _vectors
+    snap = catalog.snapshot()
+    order = sorted(snap.by_id)
+    _texts.clear()
+    _texts.update({i: embeddings.item_text(snap.by_id[i]) for i in order})
+    _ids = np.asarray(order, dtype=np.int64)
+    _vectors = embeddings.embed([_texts[i] for i in order])
+
+# ── Build ──────────────────────────────────────────────────
+
+def build() -> int:
+    """Recompute every item's neighbour list and persist it."""
+    with _lock:
+        _embed_catalog()
+        _graph.clear()
+        for start in range(0, len(_ids), BLOCK):
+            block = _vectors[start:start + BLOCK] @ _vectors.T
+            for row, scores in enumerate(block):
+                rid = int(_ids[start + row])
+                _graph[rid] = _top_k(scores, _ids, rid)
+        _dirty.clear()
+        _save(list(_graph))
+        print(f"[similar] Built kNN graph for {len(_graph)} items (k={K})")
+        return len(_graph)
+
+def _load():
+    """Adopt the stored graph if it covers the current catalog, else rebuild."""
+    global _loaded
+    stored = {r["_id"]: r for r in db.scan(COLLECTION)}
+    ids = set(catalog.snapshot().by_id)
+    if ids and set(stored) >= ids and all(r.get("provider") == embeddings.PROVIDER for r in stored.values()):
+        with _lock:
+            _embed_catalog()
+            _graph.clear()
+            _graph.update({rid: [(int(n), float(s)) for n, s in stored[rid]["neighbors"]] for rid in ids})
+        print(f"[similar] Loaded kNN graph for {len(_graph)} items")
+    else:
+        build()
+    _loaded = True
+
+def _apply_dirty():
+    """Incremental update for items written since the last lookup."""
+    global _ids, _vectors
+    with _lock:
+        if not _dirty:
+            return
+        snap = catalog.snapshot()
+        dirty = set(_dirty)
+        _dirty.clear()
+        rows = {int(rid): vec for rid, vec in zip(_ids, _vectors)}
+        changed = sorted(i for i in dirty if i in snap.by_id)
+        removed = {i for i in dirty if i not in snap.by_id}
+        _texts.update({i: embeddings.item_text(snap.by_id[i]) for i in changed})
+        for rid, vec in zip(changed, embeddings.embed([_texts[i] for i in changed])):
+            rows[rid] = vec
+        for rid in removed:
+            rows.pop(rid, None)
+            _graph.pop(rid, None)
+            _texts.pop(rid, None)
+        order = sorted(rows)
+        _ids = np.asarray(order, dtype=np.int64)
+        _vectors = (np.stack([rows[i] for i in order]) if order
+                    else np.zeros((0, embeddings.DIMENSION), dtype=np.float32))
+
+        touched = set(changed)
+        sims = None
+        if changed:
+            pos = np.searchsorted(_ids, changed)
+            sims = _vectors[pos] @ _vectors.T  # (changed, n)
+            for n, rid in enumerate(changed):
+                _graph[rid] = _top_k(sims[n], _ids, rid)
+        # A list that held a changed/removed item is recomputed, since its old
+        # order is stale; otherwise changed items can only enter it.
+        for col, other in enumerate(_ids.tolist()):
+            if other in touched:
+                continue
+            old = _graph.get(other, [])
+            if any(n in dirty for n, _ in old):
+                _graph[other] = _top_k(_vectors @ _vectors[col], _ids, other)
+                touched.add(other)
+            elif sims is not None:
+                floor = old[-1][1] if len(old) >= K else -np.inf
+                entering = [(rid, round(float(sims[n, col]), 4)) for n, rid in enumerate(changed)
+                            if sims[n, col] > floor]
+                if entering:
+                    _graph[other] = sorted(old + entering, key=lambda p: -p[1])[:K]
+                    touched.add(other)
+        for rid in removed:
+            db.delete_record(COLLECTION, rid)
+        _save(sorted(touched))
+        print(f"[similar] Updated {len(changed)} items, removed {len(removed)}, patched {len(touched)} lists")
+
+def _on_write(ids, payloads):
+    global _loaded
+    with _lock:
+        if ids is None:
+            _loaded = False
+            _graph.clear()
+            _dirty.clear()
+        else:
+            # Only text changes move an item in embedding space (not stock/cost)
+            _dirty.update(rid for rid, p in zip(ids, payloads)
+                          if p is None or _texts.get(rid) != embeddings.item_text(p))
+
+db.on_write(catalog.COLLECTION, _on_write)
+
+# ── Lookup ─────────────────────────────────────────────────
+
+def neighbors(item_id: int, limit: int = K) -> List[tuple[int, float]]:
+    if not _loaded:
+        _load()
+    if _dirty:
+        _apply_dirty()
+    return _graph.get(item_id, [])[:limit]
+
+if __name__ == "__main__":
+    build()
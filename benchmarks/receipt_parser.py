@@ -0,0 +1,68 @@
+"""
+Receipt parser benchmark
+========================
+Runs backend/receipt_parser.parse over the labelled corpus in
+benchmarks/receipt_corpus.jsonl and reports per-field accuracy, the
+receipts it got wrong, and parse time per receipt.
+
+    python benchmarks/receipt_parser.py
+    python benchmarks/receipt_parser.py --corpus my_receipts.jsonl --repeat 2000 -v
+
+Corpus lines: {"source": ..., "lines": [...], "expected": {"amount", "receiptNumber", "date", "category"}}.
+Add a line whenever a real receipt is mis-parsed.
+"""
+
+import argparse, json, os, statistics, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.receipt_parser import parse
+
+FIELDS = ["amount", "receiptNumber", "date", "category"]
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "receipt_corpus.jsonl")
+
+def load(path: str) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def matches(field: str, got, expected) -> bool:
+    if field == "amount":
+        return abs(float(got) - float(expected)) < 0.005
+    return str(got).upper() == str(expected).upper()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--corpus", default=DEFAULT_CORPUS)
+    ap.add_argument("--repeat", type=int, default=500, help="timing passes over the corpus")
+    ap.add_argument("-v", "--verbose", action="store_true", help="list every wrong field")
+    args = ap.parse_args()
+
+    corpus = load(args.corpus)
+    correct = {f: 0 for f in FIELDS}
+    for case in corpus:
+        fields, confidence = parse(case["lines"])
+        for f in FIELDS:
+            if matches(f, fields[f], case["expected"][f]):
+                correct[f] += 1
+            elif args.verbose:
+                print(f"  {case['source']:16s} {f:14s} got {fields[f]!r} (conf {confidence[f]}) "
+                      f"expected {case['expected'][f]!r}")
+
+    n = len(corpus)
+    print(f"{n} receipts")
+    for f in FIELDS:
+        print(f"  {f:14s} {correct[f]:4d}/{n}  {100 * correct[f] / n:5.1f}%")
+    exact = sum(all(matches(f, parse(c["lines"])[0][f], c["expected"][f]) for f in FIELDS) for c in corpus)
+    print(f"  {'all fields':14s} {exact:4d}/{n}  {100 * exact / n:5.1f}%")
+
+    runs = []
+    for _ in range(5):
+        t0 = time.perf_counter()
+        for _ in range(args.repeat // 5 or 1):
+            for case in corpus:
+                parse(case["lines"])
+        runs.append((time.perf_counter() - t0) / ((args.repeat // 5 or 1) * n))
+    print(f"\nparse: {statistics.median(runs) * 1e6:.1f} µs/receipt (median of 5 runs)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Receipt preprocessing benchmark
+===============================
+Runs backend/receipt_image.preprocess over a folder of receipt photos and
+reports bytes in/out and time per image. With --ocr (and easyocr
+installed) it also times EasyOCR on the raw file vs the preprocessed image.
+
+    python benchmarks/receipt_preprocess.py path/to/receipts/
+    python benchmarks/receipt_preprocess.py --synthetic 20 --ocr
+
+Without a folder, a synthetic corpus of phone-sized receipt photos is
+generated (white slip with text on a darker table, EXIF-rotated JPEGs).
+"""
+
+import argparse, io, os, random, statistics, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+from backend.receipt_image import preprocess
+
+EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+
+def synthetic_receipt(seed: int) -> bytes:
+    rnd = random.Random(seed)
+    w, h = 3024, 4032  # upright portrait photo
+    table = np.clip(np.random.default_rng(seed).normal(70, 18, (h // 8, w // 8, 3)), 0, 255).astype(np.uint8)
+    img = Image.fromarray(table).resize((w, h))
+    pw, ph = rnd.randint(1300, 1800), rnd.randint(2600, 3400)
+    x0, y0 = rnd.randint(200, w - pw - 200), rnd.randint(50, h - ph - 50)
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([x0, y0, x0 + pw, y0 + ph], fill=(238, 236, 228))
+    lines = ["BART  Clipper Reload", f"Receipt #{rnd.randint(100000, 999999)}", "2026-02-14 08:31"]
+    lines += [f"Item {i:02d} ............ ${rnd.uniform(1, 40):.2f}" for i in range(rnd.randint(5, 14))]
+    lines += ["", f"TOTAL ............ ${rnd.uniform(10, 120):.2f}", "Thank you!"]
+    font = ImageFont.load_default(size=64)
+    for i, line in enumerate(lines):
+        draw.text((x0 + 80, y0 + 120 + i * 110), line, fill=(30, 30, 30), font=font)
+    img = img.filter(ImageFilter.GaussianBlur(1.2))
+    # Store the pixels sideways with the EXIF tag that turns them upright again
+    orientation = rnd.choice([1, 6, 8])
+    if orientation == 6:
+        img = img.transpose(Image.Transpose.ROTATE_90)
+    elif orientation == 8:
+        img = img.transpose(Image.Transpose.ROTATE_270)
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=92, exif=exif)
+    return buf.getvalue()
+
+def load_corpus(args) -> list[tuple[str, bytes]]:
+    if args.folder:
+        files = sorted(f for f in os.listdir(args.folder) if os.path.splitext(f)[1].lower() in EXTS)
+        return [(f, open(os.path.join(args.folder, f), "rb").read()) for f in files]
+    return [(f"synthetic-{i}.jpg", synthetic_receipt(i)) for i in range(args.synthetic)]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("folder", nargs="?")
+    ap.add_argument("--synthetic", type=int, default=12)
+    ap.add_argument("--ocr", action="store_true", help="also time EasyOCR before/after")
+    args = ap.parse_args()
+
+    corpus = load_corpus(args)
+    reader = None
+    if args.ocr:
+        try:
+            import easyocr
+            reader = easyocr.Reader(["en"], gpu=False, verbose=False)
+        except ImportError:
+            print("easyocr not installed; skipping OCR timings")
+
+    rows = []
+    for name, data in corpus:
+        p = preprocess(data)
+        row = {"name": name, "in": len(data), "out": len(p.data), "ms": p.ms, "steps": p.steps}
+        if reader is not None and p.image is not None:
+            t0 = time.perf_counter(); reader.readtext(data); row["ocr_raw"] = time.perf_counter() - t0
+            t0 = time.perf_counter(); reader.readtext(p.image); row["ocr_pre"] = time.perf_counter() - t0
+        rows.append(row)
+        print(f"{name:28s} {row['in'] / 1e6:6.2f} MB -> {row['out'] / 1e3:7.1f} KB "
+              f"{row['ms']:7.1f} ms  {','.join(row['steps'])}")
+
+    total_in, total_out = sum(r["in"] for r in rows), sum(r["out"] for r in rows)
+    print(f"\n{len(rows)} images: {total_in / 1e6:.1f} MB -> {total_out / 1e6:.2f} MB "
+          f"({100 * (1 - total_out / max(total_in, 1)):.1f}% smaller), "
+          f"median {statistics.median(r['ms'] for r in rows):.1f} ms/image")
+    timed = [r for r in rows if "ocr_raw" in r]
+    if timed:
+        raw, pre = sum(r["ocr_raw"] for r in timed), sum(r["ocr_pre"] for r in timed)
+        print(f"EasyOCR: {raw:.1f}s raw vs {pre:.1f}s preprocessed ({raw / max(pre, 1e-9):.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,7 @@ print("--- Actian VectorAI Inspection ---")
 try:
     with CortexClient(db.ACTIAN_HOST) as c:
         # Check collections
-        for name in db.COLLECTIONS:
+        for name in db.physical_collections():
             if c.has_collection(name):
                 print(f"✅ Collection '{name}' exists.")
             else:
@@ -39,15 +39,13 @@ try:
         start_time = time.time()
         for i in range(10):
             try:
-                # Use c2, not c
-                res = c2.scroll("verified_users")
-                records = res[0] if isinstance(res, tuple) else res
+                # Full parallel scan (all shards, all id ranges)
+                records = list(db.scan("verified_users"))
                 print(f"Scroll Attempt {i+1}: Found {len(records)} records")
                 
                 # Check if test_id is in records
                 for r in records:
-                    rid = r.id if hasattr(r, 'id') else getattr(r, '_id', None)
-                    if rid == test_id:
+                    if r["_id"] == test_id:
                         print(f"✅ Found ID {test_id} in scroll after {time.time() - start_time:.2f}s")
                         found_in_scroll = True
                         break
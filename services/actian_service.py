@@ -1,14 +1,18 @@
 """
 Actian VectorAI DB Service
 ===========================
-Two collections:
-  1. marketplace  – reward item embeddings (semantic search for recommendations)
-  2. wallet       – transaction embeddings (anomaly detection, history search)
+Three collections:
+  1. marketplace_vectors – reward item embeddings (semantic search for recommendations)
+  2. wallet              – transaction embeddings (anomaly detection, history search)
+  3. user_taste          – per-user taste vectors (batch-built by backend/recommend.py)
+
+Item records themselves live in the backend's `marketplace` collection
+(4-dim placeholder vectors), so the embeddings get their own collection.
 
 Usage (CLI):
     python services/actian_service.py setup
     python services/actian_service.py upsert_product  '{"id":0,"vector":[0.1,...], "metadata":{...}}'
-    python services/actian_service.py search_marketplace '{"vector":[0.1,...], "limit":5}'
+    python services/actian_service.py search_marketplace '{"vector":[0.1,...], "limit":5, "filter":{"type":"GIFT_CARD"}}'
     python services/actian_service.py upsert_wallet '{"id":0,"vector":[0.1,...], "metadata":{...}}'
     python services/actian_service.py search_wallet  '{"vector":[0.1,...], "limit":5}'
     python services/actian_service.py health
@@ -21,13 +25,15 @@ import os
 
 # Graceful import – works without the .whl installed (returns mock data)
 try:
-    from cortex import CortexClient, DistanceMetric
+    from cortex import CortexClient, CortexError, DistanceMetric
     HAS_CORTEX = True
 except ImportError:
     HAS_CORTEX = False
 
 ACTIAN_HOST = os.getenv("ACTIAN_HOST", "localhost:50051")
 DIMENSION   = 128  # embedding dimension for demo
+MARKETPLACE = os.getenv("ACTIAN_MARKETPLACE_VECTORS", "marketplace_vectors")
+USER_TASTE  = os.getenv("ACTIAN_USER_TASTE", "user_taste")
 
 # ── Collection helpers ─────────────────────────────────────
 
@@ -36,18 +42,21 @@ def get_client():
 
 
 def setup():
-    """Create the two collections if they don't exist."""
+    """Create the collections if they don't exist."""
     if not HAS_CORTEX:
         return {"status": "skipped", "reason": "actiancortex not installed"}
 
     with get_client() as c:
         ver, up = c.health_check()
         # Marketplace collection (cosine similarity for product recs)
-        if not c.has_collection("marketplace"):
-            c.create_collection("marketplace", DIMENSION, distance_metric=DistanceMetric.COSINE)
+        if not c.has_collection(MARKETPLACE):
+            c.create_collection(MARKETPLACE, DIMENSION, distance_metric=DistanceMetric.COSINE)
         # Wallet collection (euclidean for anomaly / distance analysis)
         if not c.has_collection("wallet"):
             c.create_collection("wallet", DIMENSION, distance_metric=DistanceMetric.EUCLIDEAN)
+        # Taste collection (cosine, queried by id only)
+        if not c.has_collection(USER_TASTE):
+            c.create_collection(USER_TASTE, DIMENSION, distance_metric=DistanceMetric.COSINE)
 
     return {"status": "ok", "version": ver, "uptime": str(up)}
 
@@ -70,7 +79,7 @@ def upsert_product(payload: dict):
         return {"status": "mocked"}
 
     with get_client() as c:
-        c.upsert("marketplace",
+        c.upsert(MARKETPLACE,
                   id=int(payload["id"]),
                   vector=payload["vector"],
                   payload=payload.get("metadata", {}))
@@ -85,16 +94,28 @@ def batch_upsert_products(payload: dict):
         return {"status": "mocked"}
 
     with get_client() as c:
-        c.batch_upsert("marketplace",
+        c.batch_upsert(MARKETPLACE,
                        ids=payload["ids"],
                        vectors=payload["vectors"],
                        payloads=payload.get("payloads", []))
     return {"status": "ok", "count": len(payload["ids"])}
 
 
+def delete_products(payload: dict):
+    """Remove product vectors.
+    payload: { ids: int[] }
+    """
+    if not HAS_CORTEX:
+        return {"status": "mocked"}
+
+    with get_client() as c:
+        c.batch_delete(MARKETPLACE, ids=payload["ids"])
+    return {"status": "ok", "count": len(payload["ids"])}
+
+
 def search_marketplace(payload: dict):
     """K-NN search in marketplace.
-    payload: { vector: float[], limit: int }
+    payload: { vector: float[], limit: int, filter?: {field: value | {"$lte": ...}} }
     """
     if not HAS_CORTEX:
         return [
@@ -104,12 +125,61 @@ def search_marketplace(payload: dict):
         ]
 
     with get_client() as c:
-        results = c.search("marketplace",
+        flt = payload.get("filter")
+        results = c.search(MARKETPLACE,
                            query=payload["vector"],
-                           top_k=payload.get("limit", 5))
+                           top_k=payload.get("limit", 5),
+                           filter=json.dumps(flt) if flt else None,
+                           with_payload=True)
     return [{"id": r.id, "score": r.score, "payload": r.payload} for r in results]
 
 
+# ── User taste vectors ─────────────────────────────────────
+
+def upsert_tastes(payload: dict):
+    """Batch store taste vectors, keyed by user id.
+    payload: { ids: int[], vectors: float[][], payloads: {}[] }
+    """
+    if not HAS_CORTEX:
+        return {"status": "mocked"}
+
+    with get_client() as c:
+        c.batch_upsert(USER_TASTE,
+                       ids=payload["ids"],
+                       vectors=payload["vectors"],
+                       payloads=payload.get("payloads", []))
+    return {"status": "ok", "count": len(payload["ids"])}
+
+
+def delete_tastes(payload: dict):
+    """Drop taste vectors of users with no signals left.
+    payload: { ids: int[] }
+    """
+    if not HAS_CORTEX:
+        return {"status": "mocked"}
+
+    with get_client() as c:
+        c.batch_delete(USER_TASTE, ids=payload["ids"])
+    return {"status": "ok", "count": len(payload["ids"])}
+
+
+def get_taste(payload: dict):
+    """Fetch one taste vector.
+    payload: { id: int } -> { id, vector, payload } or None
+    """
+    if not HAS_CORTEX:
+        return None
+
+    with get_client() as c:
+        try:
+            result = c.get(USER_TASTE, int(payload["id"]))
+        except CortexError:
+            return None  # the beta client raises for an id it doesn't have
+    if not result or result[0] is None:
+        return None
+    return {"id": int(payload["id"]), "vector": list(result[0]), "payload": result[1]}
+
+
 # ── Wallet / Transaction operations ────────────────────────
 
 def upsert_wallet(payload: dict):
@@ -148,7 +218,7 @@ def get_stats():
     if not HAS_CORTEX:
         return {"marketplace": "mock", "wallet": "mock"}
     with get_client() as c:
-        m = c.get_stats("marketplace")
+        m = c.get_stats(MARKETPLACE)
         w = c.get_stats("wallet")
     return {"marketplace": str(m), "wallet": str(w)}
 
@@ -160,6 +230,9 @@ COMMANDS = {
     "health":             lambda p: health(),
     "upsert_product":     upsert_product,
     "batch_upsert":       batch_upsert_products,
+    "delete_products":    delete_products,
+    "upsert_tastes":      upsert_tastes,
+    "get_taste":          get_taste,
     "search_marketplace": search_marketplace,
     "upsert_wallet":      upsert_wallet,
     "search_wallet":      search_wallet,
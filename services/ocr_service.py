@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
 """
-EasyOCR Receipt Scanner – run as subprocess from FastAPI.
+EasyOCR Receipt Scanner – one-shot CLI.
 Usage:  python ocr_service.py /path/to/image.png
-Outputs JSON to stdout.
+Outputs JSON to stdout. The API uses the warm worker pool in
+backend/ocr_pool.py instead, which loads the model once per worker.
 """
 import sys, json, re, os
 
+# Shared preprocessing lives in the backend package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 def scan(path: str) -> dict:
     try:
         import easyocr
@@ -15,9 +19,20 @@ def scan(path: str) -> dict:
     if not os.path.isfile(path):
         return {"error": f"File not found: {path}"}
 
+    from backend.receipt_image import preprocess
+    with open(path, "rb") as f:
+        prepared = preprocess(f.read())
+
     reader = easyocr.Reader(["en"], gpu=False, verbose=False)
-    results = reader.readtext(path, detail=1)
+    # Downscaled, cropped grayscale array when decodable; the file otherwise
+    source = prepared.image if prepared.image is not None else path
+    result = summarize(reader.readtext(source, detail=1))
+    result["file"] = os.path.basename(path)
+    result["preprocess"] = prepared.summary()
+    return result
 
+def summarize(results) -> dict:
+    """Shape EasyOCR `readtext(detail=1)` output (shared with backend/ocr_pool.py)."""
     lines = []
     totals = []
     for bbox, text, conf in results:
@@ -34,7 +49,6 @@ def scan(path: str) -> dict:
         "lineCount": len(lines),
         "amounts": totals,
         "detected_total": detected_total,
-        "file": os.path.basename(path),
     }
 
 if __name__ == "__main__":